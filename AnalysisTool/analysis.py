@@ -9,10 +9,9 @@
 
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
-import statsmodels.api as sm
-from statsmodels.miscmodels.ordinal_model import OrderedModel
+from AnalysisTool import tabulation, regression, plotting
+# matplotlib, seaborn and statsmodels are imported where they are used, so
+# importing this module (and weighting) only loads numpy and pandas.
 
 #matplotlib.rcParams.update(_VSCode_defaultMatplotlib_Params)
 
@@ -43,28 +42,19 @@ class Table:
         
         :return : pd.DataFrame
         '''
-        df = self.df
-        if w:
-            a = pd.Series(df[[var, w]].groupby(var).sum()[w]) / df[w].sum()
-            if label:
-                b = label
-            else:
-                b = a.index
-            c = np.round(a.values, 2)
-            d = rounding(df[[var, w]].groupby(var).sum()[w])
-            df_temp = pd.DataFrame({'Label': b, 'Num': d, 'Freq': c})
-            return df_temp
-        else:
-            df[w] = 1
-            a = pd.Series(df[[var, w]].groupby(var).sum()[w]) / df[w].sum()
-            if label:
-                b = label
-            else:
-                b = a.index
-            c = np.round(a.values, 2)
-            d = rounding(df[[var, w]].groupby(var).sum()[w])
-            df_temp = pd.DataFrame({'Label': b, 'Num': d, 'Freq': c})
-            return df_temp
+        return tabulation.freq(self.df, var, w=w, label=label)
+
+    def freq_batch(self, variables: list, w=None, label=None):
+        '''
+        Frequency distribution tables of many variables.
+
+        :variables (list): The variables want to inspect.
+        :w (str): Optional. The column which will be used to weighted by.
+        :label (dict): Optional. {variable: list of labels}.
+
+        :return : dict {variable: pd.DataFrame}
+        '''
+        return tabulation.freq_batch(self.df, variables, w=w, label=label)
     
     def cross(self, r_var: str, c_var: str, w= None, percent_by='row'):
         '''
@@ -72,47 +62,26 @@ class Table:
 
         : r_var (str): The variable of row.
         : c_var (str): The variable of column.
+        : w (str): Optional. The column of weight, used by the counts and
+                   by both row and column percents.
 
         : return : pd.DataFrame
         '''
-        df = self.df
-        if w:
-            if percent_by == 'row':
-                df_num = pd.crosstab(df[r_var], df[c_var], values=df[w], aggfunc=sum,
-                                    margins=True).round(0).astype(int)
-                df_freq = pd.crosstab(df[r_var], df[c_var], values=df[w], aggfunc=sum,
-                                     margins=True,
-                                     normalize='index').round(2)
-                df_cross = pd.merge(df_num, df_freq, on=r_var, suffixes=['_nums', '_rfreq'])
-                return df_cross
-            elif percent_by== 'col':
-                df_num = pd.crosstab(df[r_var], df[c_var], values=df[w], aggfunc=sum,
-                                     margins=True).round(0).astype(int)
-                df_freq = pd.crosstab(df[r_var], df[c_var],
-                                     margins=True,
-                                     normalize='columns').round(2)
-                df_cross = pd.merge(df_num, df_freq, on=r_var, suffixes=['_nums', '_cfreq'])
-                return df_cross
-        else:
-            if percent_by == 'row':
-                df_num = pd.crosstab(df[r_var], df[c_var],
-                                     margins=True)
-                df_freq = pd.crosstab(df[r_var], df[c_var],
-                                     margins=True,
-                                     normalize='index').round(2)
-                df_cross = pd.merge(df_num, df_freq, on=r_var, suffixes=['_nums', '_rfreq'])
-                return df_cross
-            elif percent_by== 'col':
-                df_num = pd.crosstab(df[r_var], df[c_var],
-                                     margins=True)
-                df_freq = pd.crosstab(df[r_var], df[c_var],
-                                     margins=True,
-                                     normalize='columns').round(2)
-                df_cross = pd.merge(df_num, df_freq, on=r_var, suffixes=['_nums', '_cfreq'])
-                return df_cross
+        return tabulation.cross(self.df, r_var, c_var, w=w, percent_by=percent_by)
+
+    def cross_batch(self, rows: list, banner: str, w=None, percent_by='row'):
+        '''
+        Cross tables of many variables against one banner variable.
+
+        : rows (list): The variables of row.
+        : banner (str): The variable of column.
+
+        : return : dict {row variable: pd.DataFrame}
+        '''
+        return tabulation.cross_batch(self.df, rows, banner, w=w, percent_by=percent_by)
 
 class Regression:
-    def __init__(self, data, DV: str, IV: list, CV=[], method='OLS'):
+    def __init__(self, data, DV: str, IV: list, CV=[], method='OLS', w=None):
         '''
         Bulid up a regression model.
 
@@ -123,19 +92,11 @@ class Regression:
         : method (str): Method of fit the model.
                         Include OLS, Logit, Order.
                         Defalt = 'OLS'
+        : w (str): Optional. The column of weight. Defalt = None
+        For many groups or waves at once see regression.fit_groups.
         '''
-        y = data[DV]
-        x = data[IV+CV]
-        if method == 'OLS':
-            x = sm.add_constant(x)
-            self.result = sm.OLS(y, x).fit()
-        
-        if method == 'Logit':
-            x = sm.add_constant(x)
-            self.result = sm.Logit(y, x).fit()
-        
-        if method == 'Order':
-            self.result = OrderedModel(y, x, distr='probit').fit(method='bfgs')
+        self.terms = IV + CV
+        self.result = regression.fit(data, DV, IV, CV=CV, method=method, w=w)
     
     def coef(self):
         '''
@@ -143,22 +104,11 @@ class Regression:
 
         : return : pd.DataFrame
         '''
-        df = pd.DataFrame(self.result.summary().tables[1].data)
-        df.columns = df.iloc[0]
-        df = df.drop(0)
-        df = df.set_index(df.columns[0])
-        df = df.astype(float)
-        df['errors'] = df['coef'] - df['[0.025']
-
-        try:
-            df =df.drop(['const'])
-        except:
-            pass
-        try:
-            df = df.drop(['1.0/2.0', '2.0/3.0', '3.0/4.0'])
-        except:
-            pass
-
+        stat = 't' if getattr(self.result, 'use_t', False) else 'z'
+        df = regression.coef_table(self.result, self.terms)
+        df = df.rename(columns={'std_err': 'std err', 'stat': stat, 'p_value': f'P>|{stat}|',
+                                'ci_lower': '[0.025', 'ci_upper': '0.975]'})
+        df.index.name = None
         return df
 
 
@@ -168,20 +118,28 @@ class Coef_Plot:
         Pick up the models to be plotted.
 
         :data: List of pd.DataFrame from the return of object Regression.coef().
+        For many plots written to files see plotting.render_batch.
         '''
-        plt.style.use('seaborn')
-        plt.rcParams['font.sans-serif'] = ['Taipei Sans TC Beta']
-
-        sns.set_context('poster')
+        plotting.setup_style()
         
         if type(data) == list:
             self.data = data
         else:
             self.data = [data]
+
+    def _show(self, kind, path=None, **kwargs):
+        import matplotlib.pyplot as plt
+        fig = plt.figure(figsize=(8, 6), dpi=300, facecolor='w')
+        plotting.draw(fig.gca(), kind, self.data, **kwargs)
+        if path:
+            fig.savefig(path, bbox_inches='tight')
+            plt.close(fig)
+        else:
+            plt.show()
     
     def single_model(self, data_ord= 0, title=None,
                      colors = 'royalblue',
-                     ylabel='coef.'):
+                     ylabel='coef.', path=None):
         '''
         Coefficient plot of one regression model.
 
@@ -191,29 +149,18 @@ class Coef_Plot:
         :title (str): Title of the figure. Defult=None.
         :colors (str): Color of the elements. Defult='royalblue'.
         :ylabel (str): Label of y-axis. Defult=coef.
+        :path (str): Optional. Save the figure to this file instead of showing it.
+                     Defult=None.
         '''
-        plt.figure(figsize=(8, 6), dpi= 300, facecolor = 'w')
-        
-        df = self.data[data_ord]
-        plt.bar(df.index, df['coef'], color='none',
-                yerr= df['errors'], ecolor= colors)
-        plt.scatter(range(0, len(df['coef'])), df['coef'], color=colors, marker='o', s=80)
-
-        plt.axhline(y= 0, color='silver', linestyle='--', linewidth=4)
-
-        plt.xticks(rotation=90, fontsize=18)
-        plt.xticks(fontsize=18)
-        plt.title(title, fontsize=24)
-        plt.ylabel(ylabel, fontsize=12)
-
-        plt.show()
+        self._show('single_model', path, data_ord=data_ord, title=title,
+                   colors=colors, ylabel=ylabel)
     
     def multi_year(self, IV: str, title=None,
                    label=None,
                    colors='royalblue',
-                   ylabel='coef.', legend_loc='upper right'):
+                   ylabel='coef.', legend_loc='upper right', years=None, path=None):
         '''
-        Figure about the change of coef in 2008~2020.
+        Figure about the change of coef across the years, one model per year.
 
         :IV (str): The variable of observation.
         :title (str): Title of the figure. Defult=None.
@@ -221,37 +168,17 @@ class Coef_Plot:
         :colors (str): Color of the elements. Defult='royalblue'.
         :ylabel (str): Label of y-axis. Defult=coef.
         :legend_loc (str): Location of legend. Defult='upper right'.
+        :years (list): Optional. Year of every model.
+                       Defult=None, eg. 2008, 2012, 2016, ...
+        :path (str): Optional. Save the figure to this file instead of showing it.
+                     Defult=None.
         '''
-        plt.figure(figsize=(8, 6), dpi=300, facecolor='w')
-
-        model = self.data
-        if len(model) != 4: # The Coef_plot object must have 4 models or it wont work subsequently.
-            return print('Error! The Coef_plot object must have 4 models.')
-
-        x = [2008, 2012, 2016, 2020]
-        y = [m.loc[IV]['coef'] for m in model]
-        
-        err = [m.loc[IV]['errors'] for m in model]
-
-        plt.bar(x, y, color='none',
-                yerr= err, ecolor= colors)
-        plt.scatter(x, y, color=colors, marker='o', s=80)
-        plt.plot(x, y, color=colors, label=label)
-
-        plt.axhline(y= 0, color='silver', linestyle='--', linewidth=4)
-
-        plt.xticks(x, rotation=90, fontsize=18)
-        plt.title(title, fontsize=24)
-        plt.ylabel(ylabel, fontsize=12)
-
-        if label:
-            plt.legend(loc=legend_loc, fontsize=12)
-
-        plt.show()
+        self._show('multi_year', path, IV=IV, years=years, title=title, label=label,
+                   colors=colors, ylabel=ylabel, legend_loc=legend_loc)
     
     def multi_year_2model(self, iv1: str, iv2: str, title=None,
                           label1=None, label2=None, c1='royalblue', c2='m', 
-                          ylabel='coef.', legend_loc='upper right'):
+                          ylabel='coef.', legend_loc='upper right', years=None, path=None):
         '''
         Plot two variables for comparision.
 
@@ -263,34 +190,14 @@ class Coef_Plot:
         :c2 (str): Color of the IV2. Defult='magenta'.
         :ylabel (str): Label of y-axis. Defult=coef.
         :legend_loc (str): Location of legend. Defult='upper right'.
-        '''
-        
-        model = self.data
-        plt.figure(figsize=(8, 6), dpi=300, facecolor='w')
-
-        x = [2008, 2012, 2016, 2020]
-        y1 = [m.loc[iv1]['coef'] for m in model]
-        y2 = [m.loc[iv2]['coef'] for m in model]
-        err1 = [m.loc[iv1]['errors'] for m in model]
-        err2 = [m.loc[iv2]['errors'] for m in model]
-
-        plt.bar(x, y1, color='none',
-                yerr= err1, ecolor= c1)
-        plt.scatter(x, y1, color=c1, marker='o', s=80, label=label1)
-        plt.plot(x, y1, color=c1)        
-
-        plt.bar([i + 0.5 for i in x], y2, color='none',
-                yerr= err2, ecolor= c2)
-        plt.scatter([i + 0.5 for i in x], y2, color=c2, marker='o', s=80, label=label2)
-        plt.plot([i + 0.5 for i in x], y2, color=c2)   
-        plt.axhline(y= 0, color='silver', linestyle='--', linewidth=4)
-        plt.legend(loc='lower right', fontsize=14)
-        plt.xticks(x, fontsize=18)
-        plt.ylabel(ylabel, fontsize=12)
-        plt.title(title, fontsize=24)
-        plt.legend(loc=legend_loc, fontsize=12)
-
-        plt.show()
+        :years (list): Optional. Year of every model.
+                       Defult=None, eg. 2008, 2012, 2016, ...
+        :path (str): Optional. Save the figure to this file instead of showing it.
+                     Defult=None.
+        '''
+        self._show('multi_year_2model', path, iv1=iv1, iv2=iv2, years=years, title=title,
+                   label1=label1, label2=label2, c1=c1, c2=c2, ylabel=ylabel,
+                   legend_loc=legend_loc)
 
 if __name__ == '__main__':
     data = pd.read_csv('modeldata.csv')
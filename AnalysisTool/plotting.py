@@ -0,0 +1,174 @@
+#!/usr/bin/python
+# -*- encoding: utf-8 -*-
+# File    :   plotting.py
+# Description : Coefficient plots drawn on a given axes, and headless batch
+#               rendering of many plots to PNG/SVG files in worker processes.
+#               Batch rendering never goes through pyplot, so it never opens
+#               a window or blocks on plt.show().
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+KINDS = ['single_model', 'multi_year', 'multi_year_2model']
+
+_styled = False # The style is applied once per process, see setup_style.
+_figure = None  # Figure reused by every plot rendered in this process.
+
+
+def setup_style():
+    '''
+    Apply the seaborn style, font and poster context once per process.
+    '''
+    global _styled
+    if _styled:
+        return
+    import matplotlib
+    import seaborn as sns
+
+    # 'seaborn' was renamed 'seaborn-v0_8' in matplotlib 3.6.
+    style = 'seaborn' if 'seaborn' in matplotlib.style.available else 'seaborn-v0_8'
+    matplotlib.style.use(style)
+    matplotlib.rcParams['font.sans-serif'] = ['Taipei Sans TC Beta']
+    sns.set_context('poster')
+    _styled = True
+
+
+def default_years(n):
+    '''
+    The waves 2008, 2012, ... of n models.
+    '''
+    return [2008 + 4 * i for i in range(n)]
+
+
+def draw_single(ax, df, title=None, colors='royalblue', ylabel='coef.'):
+    '''
+    Coefficient plot of one model, see Coef_Plot.single_model.
+    '''
+    ax.bar(df.index, df['coef'], color='none', yerr=df['errors'], ecolor=colors)
+    ax.scatter(range(0, len(df['coef'])), df['coef'], color=colors, marker='o', s=80)
+    ax.axhline(y=0, color='silver', linestyle='--', linewidth=4)
+    ax.tick_params(axis='x', labelrotation=90, labelsize=18)
+    ax.set_title(title, fontsize=24)
+    ax.set_ylabel(ylabel, fontsize=12)
+
+
+def draw_years(ax, models, IV, years=None, title=None, label=None, colors='royalblue',
+               ylabel='coef.', legend_loc='upper right'):
+    '''
+    Coefficient of IV across waves, see Coef_Plot.multi_year.
+    '''
+    x = years if years is not None else default_years(len(models))
+    y = [m.loc[IV]['coef'] for m in models]
+    err = [m.loc[IV]['errors'] for m in models]
+
+    ax.bar(x, y, color='none', yerr=err, ecolor=colors)
+    ax.scatter(x, y, color=colors, marker='o', s=80)
+    ax.plot(x, y, color=colors, label=label)
+    ax.axhline(y=0, color='silver', linestyle='--', linewidth=4)
+    ax.set_xticks(x)
+    ax.tick_params(axis='x', labelrotation=90, labelsize=18)
+    ax.set_title(title, fontsize=24)
+    ax.set_ylabel(ylabel, fontsize=12)
+    if label:
+        ax.legend(loc=legend_loc, fontsize=12)
+
+
+def draw_years_2model(ax, models, iv1, iv2, years=None, title=None, label1=None, label2=None,
+                      c1='royalblue', c2='m', ylabel='coef.', legend_loc='upper right'):
+    '''
+    Coefficients of two variables across waves, see Coef_Plot.multi_year_2model.
+    The second variable is shifted by an eighth of the wave spacing.
+    '''
+    x = list(years if years is not None else default_years(len(models)))
+    shift = (min(b - a for a, b in zip(x, x[1:])) if len(x) > 1 else 4) / 8
+    for iv, label, color, offset in [(iv1, label1, c1, 0), (iv2, label2, c2, shift)]:
+        xs = [i + offset for i in x]
+        y = [m.loc[iv]['coef'] for m in models]
+        err = [m.loc[iv]['errors'] for m in models]
+        ax.bar(xs, y, color='none', yerr=err, ecolor=color)
+        ax.scatter(xs, y, color=color, marker='o', s=80, label=label)
+        ax.plot(xs, y, color=color)
+    ax.axhline(y=0, color='silver', linestyle='--', linewidth=4)
+    ax.set_xticks(x)
+    ax.tick_params(axis='x', labelsize=18)
+    ax.set_ylabel(ylabel, fontsize=12)
+    ax.set_title(title, fontsize=24)
+    if label1 or label2:
+        ax.legend(loc=legend_loc, fontsize=12)
+
+
+def draw(ax, kind, data, **kwargs):
+    '''
+    Draw a plot of the given kind on ax.
+    :param kind(str): 'single_model', 'multi_year' or 'multi_year_2model'.
+    :param data(list): pd.DataFrame of every model, see Coef_Plot.
+    :param kwargs: Passed to the plot, eg. IV, title, years.
+    '''
+    if kind == 'single_model':
+        data_ord = kwargs.pop('data_ord', 0)
+        draw_single(ax, data[data_ord], **kwargs)
+    elif kind == 'multi_year':
+        draw_years(ax, data, **kwargs)
+    elif kind == 'multi_year_2model':
+        draw_years_2model(ax, data, **kwargs)
+    else:
+        raise ValueError(f'kind must be one of {KINDS}.')
+
+
+def _init_worker():
+    import matplotlib
+    matplotlib.use('Agg')
+    setup_style()
+
+
+def _render_one(job, dpi):
+    global _figure
+    from matplotlib.figure import Figure
+
+    if _figure is None:
+        _figure = Figure(figsize=(8, 6), dpi=dpi, facecolor='w')
+    # A fresh axes for every plot, so no tick or axis setting of an earlier
+    # job carries over.
+    _figure.clear()
+    ax = _figure.add_subplot()
+    job = dict(job)
+    path = job.pop('path')
+    draw(ax, job.pop('kind'), job.pop('data'), **job)
+    _figure.savefig(path, dpi=dpi, facecolor='w', bbox_inches='tight')
+    return path
+
+
+def render_batch(jobs, output_dir='.', fmt='png', dpi=300, processes=None):
+    '''
+    Render many coefficient plots to files, headless and in parallel.
+    --------------------------------------------------------------------
+    Every worker process applies the style once and reuses one figure for
+    all the plots it draws.
+    :param jobs(list): One dict per plot with kind, data, name (the file name
+                       without extension) and the arguments of the plot,
+                       eg. {'kind': 'multi_year', 'data': frames, 'name': 'N_dpp',
+                            'IV': 'N_dpp', 'years': [2008, 2012, 2016, 2020]}.
+    :param output_dir(str): Optional. Directory of the files. Defalt='.'
+    :param fmt(str): Optional. 'png' or 'svg'. Defalt='png'
+    :param dpi(int): Optional. Defalt=300
+    :param processes(int): Optional. Number of worker processes.
+                           Defalt=None, eg. os.cpu_count(); 1 runs in this process.
+    :return list of the paths written, in the order of jobs.
+    '''
+    if fmt not in ['png', 'svg']:
+        raise ValueError("fmt must be 'png' or 'svg'.")
+    os.makedirs(output_dir, exist_ok=True)
+    tasks = []
+    for job in jobs:
+        job = dict(job)
+        job['path'] = os.path.join(output_dir, f"{job.pop('name')}.{fmt}")
+        tasks.append(job)
+
+    processes = processes or os.cpu_count()
+    if processes == 1 or len(tasks) <= 1:
+        setup_style()
+        return [_render_one(job, dpi) for job in tasks]
+    workers = min(processes, len(tasks))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        return list(pool.map(_render_one, tasks, [dpi] * len(tasks),
+                             chunksize=max(1, len(tasks) // (4 * workers))))
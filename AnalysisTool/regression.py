@@ -0,0 +1,145 @@
+#!/usr/bin/python
+# -*- encoding: utf-8 -*-
+# File    :   regression.py
+# Description : OLS / Logit / ordered probit models with optional survey
+#               weights, their coefficients as plain frames read from the
+#               fitted parameters, and a runner fitting one model per group
+#               (eg. wave or subgroup) in a process pool.
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+METHODS = ['OLS', 'Logit', 'Order']
+COLUMNS = ['coef', 'std_err', 'stat', 'p_value', 'ci_lower', 'ci_upper', 'errors']
+
+
+def fit(data, DV, IV, CV=[], method='OLS', w=None):
+    '''
+    Fit one regression model.
+    ---------------------------
+    Rows with a missing value in DV, IV, CV or w, or a weight <= 0, are dropped.
+    Weights are scaled to sum to the number of rows, so the standard errors are
+    the model-based ones of a sample of that size (not design-based).
+    :param data(pandas.DataFrame): Data for the model.
+    :param DV(str): Dependent variable.
+    :param IV(list): Independent variables.
+    :param CV(list): Optional. Control variables. Defalt=[]
+    :param method(str): Optional. 'OLS', 'Logit' or 'Order' (ordered probit).
+                        Defalt='OLS'
+    :param w(str): Optional. The column of weight, eg. 'weight'. Defalt=None
+    :return statsmodels results.
+    '''
+    import statsmodels.api as sm
+    from statsmodels.miscmodels.ordinal_model import OrderedModel
+
+    if method not in METHODS:
+        raise ValueError(f'method must be one of {METHODS}.')
+    data = data[[DV] + IV + CV + ([w] if w else [])].dropna()
+    weights = None
+    if w:
+        data = data[data[w] > 0]
+        weights = data[w].to_numpy(dtype=float)
+        weights = weights * len(weights) / weights.sum()
+    y = data[DV]
+    x = data[IV + CV]
+
+    if method == 'OLS':
+        x = sm.add_constant(x)
+        if weights is None:
+            return sm.OLS(y, x).fit()
+        return sm.WLS(y, x, weights=weights).fit()
+
+    if method == 'Logit':
+        x = sm.add_constant(x)
+        if weights is None:
+            return sm.Logit(y, x).fit(disp=False)
+        return sm.GLM(y, x, family=sm.families.Binomial(), freq_weights=weights).fit()
+
+    model = OrderedModel(y, x, distr='probit')
+    if weights is not None:
+        # OrderedModel has no weights; fit and the numerical score and
+        # hessian all go through loglike, so weighting it is enough.
+        loglikeobs = model.loglikeobs
+        model.loglike = lambda params: (weights * loglikeobs(params)).sum()
+    return model.fit(method='bfgs', disp=False)
+
+
+def coef_table(result, terms=None):
+    '''
+    Coefficients of a fitted model, read from its parameters.
+    :param result: statsmodels results from fit.
+    :param terms(list): Optional. The terms to keep, eg. IV + CV, which drops
+                        the constant and the thresholds of an ordered model.
+                        Defalt=None, eg. every parameter.
+    :return pandas.DataFrame indexed by term with coef, std_err, stat
+            (t or z), p_value, ci_lower, ci_upper (95%) and errors
+            (coef - ci_lower, the error bar of Coef_Plot).
+    '''
+    ci = np.asarray(result.conf_int())
+    table = pd.DataFrame({'coef': np.asarray(result.params), 'std_err': np.asarray(result.bse),
+                          'stat': np.asarray(result.tvalues), 'p_value': np.asarray(result.pvalues),
+                          'ci_lower': ci[:, 0], 'ci_upper': ci[:, 1]},
+                         index=pd.Index(result.params.index, name='term'))
+    table['errors'] = table['coef'] - table['ci_lower']
+    if terms is not None:
+        table = table.loc[[t for t in terms if t in table.index]]
+    return table
+
+
+def _fit_one(key, data, DV, IV, CV, method, w):
+    try:
+        result = fit(data, DV, IV, CV=CV, method=method, w=w)
+    except Exception as e: # eg. a singular group; report it and carry on
+        return key, None, {'nobs': 0, 'converged': False, 'error': repr(e)}
+    converged = result.mle_retvals.get('converged', True) if hasattr(result, 'mle_retvals') else True
+    return key, coef_table(result, IV + CV), {'nobs': int(result.nobs), 'converged': converged,
+                                              'error': None}
+
+
+def fit_groups(data, by, DV, IV, CV=[], method='OLS', w=None, processes=None):
+    '''
+    Fit the same model on every group of a dataset in parallel.
+    -------------------------------------------------------------
+    :param data(pandas.DataFrame): Data holding every group.
+    :param by(str or list): The column(s) to group on, eg. 'year'.
+    :param DV, IV, CV, method, w: The model, see fit.
+    :param processes(int): Optional. Number of worker processes.
+                           Defalt=None, eg. os.cpu_count(); 1 runs in this process.
+    :return pandas.DataFrame with one row per group and term: the columns of
+            by, term, the columns of coef_table, nobs, converged and error
+            (the exception of a group that could not be fitted, else None).
+    '''
+    by = [by] if isinstance(by, str) else list(by)
+    columns = [DV] + IV + CV + ([w] if w else [])
+    positions = data.groupby(by, sort=True).indices
+    tasks = [(key, data.iloc[pos][columns]) for key, pos in positions.items()]
+
+    processes = processes or os.cpu_count()
+    if processes == 1 or len(tasks) <= 1:
+        results = [_fit_one(key, df, DV, IV, CV, method, w) for key, df in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=min(processes, len(tasks))) as pool:
+            futures = [pool.submit(_fit_one, key, df, DV, IV, CV, method, w) for key, df in tasks]
+            results = [f.result() for f in futures]
+
+    frames = []
+    for key, table, stats in results:
+        if table is None:
+            table = pd.DataFrame(columns=COLUMNS, index=pd.Index(IV + CV, name='term'), dtype=float)
+        table = table.reset_index().assign(**stats)
+        key = key if isinstance(key, tuple) else (key,)
+        for name, value in reversed(list(zip(by, key))):
+            table.insert(0, name, value)
+        frames.append(table)
+    return pd.concat(frames, ignore_index=True)
+
+
+def coef_frames(tidy, by):
+    '''
+    Split the frame of fit_groups into one coefficient frame per group,
+    in the order of the groups, eg. the data of Coef_Plot.
+    :return list of pandas.DataFrame indexed by term.
+    '''
+    return [df.set_index('term')[COLUMNS] for _, df in tidy.groupby(by, sort=True)]
@@ -0,0 +1,125 @@
+#!/usr/bin/python
+# -*- encoding: utf-8 -*-
+# File    :   tabulation.py
+# Description : Weighted frequency and cross tables from integer codes.
+#               Counts come from one bincount per variable, the input data
+#               is never modified, and many variables can be tabulated
+#               against one banner in one call.
+
+import pandas as pd
+import numpy as np
+
+
+def codes(values):
+    '''
+    Integer code of every value and the sorted levels; NaN gets -1.
+    '''
+    return pd.factorize(values, sort=True)
+
+
+def weight_array(df, w):
+    '''
+    The weights as a float array, 1 for every row when w is None.
+    NaN weights count as 0, like a pandas sum.
+    '''
+    if w is None:
+        return None
+    return np.nan_to_num(df[w].to_numpy(dtype=float))
+
+
+def counts_2d(r_codes, nr, c_codes, nc, weights=None):
+    '''
+    (Weighted) nr x nc contingency table, rows with a NaN code dropped.
+    '''
+    valid = (r_codes >= 0) & (c_codes >= 0)
+    flat = r_codes[valid] * nc + c_codes[valid]
+    return np.bincount(flat, weights=None if weights is None else weights[valid],
+                       minlength=nr * nc).reshape(nr, nc)
+
+
+def freq(df, var, w=None, label=None):
+    '''
+    Frequency distribution table, see Table.freq.
+    :return pd.DataFrame with Label, Num and Freq indexed by the levels.
+    '''
+    c, levels = codes(df[var])
+    weights = weight_array(df, w)
+    valid = c >= 0
+    num = np.bincount(c[valid], weights=None if weights is None else weights[valid],
+                      minlength=len(levels))
+    total = len(df) if weights is None else weights.sum()
+    return pd.DataFrame({'Label': label if label else levels,
+                         'Num': np.round(num, 0), 'Freq': np.round(num / total, 2)},
+                        index=pd.Index(levels, name=var))
+
+
+def layout_cross(table, r_levels, c_levels, r_var, c_var, weighted, percent_by='row'):
+    '''
+    Lay out a contingency table with its margins and row or column percents,
+    in the form returned by Table.cross.
+    '''
+    nr, nc = table.shape
+    full = np.zeros((nr + 1, nc + 1))
+    full[:nr, :nc] = table
+    full[nr, :nc] = table.sum(axis=0)
+    full[:nr, nc] = table.sum(axis=1)
+    full[nr, nc] = table.sum()
+    nums = full.round(0).astype(int) if weighted else full.astype(int)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        if percent_by == 'row':
+            pct = np.round(full[:, :nc] / full[:, nc:], 2)
+            columns = {f'{c}_nums': nums[:, j] for j, c in enumerate(c_levels)}
+            columns['All'] = nums[:, nc]
+            columns.update({f'{c}_rfreq': pct[:, j] for j, c in enumerate(c_levels)})
+            index = list(r_levels) + ['All']
+        elif percent_by == 'col':
+            pct = np.round(full[:nr] / full[nr], 2)
+            labels = list(c_levels) + ['All']
+            columns = {f'{c}_nums': nums[:nr, j] for j, c in enumerate(labels)}
+            columns.update({f'{c}_cfreq': pct[:, j] for j, c in enumerate(labels)})
+            index = list(r_levels)
+        else:
+            raise ValueError("percent_by must be 'row' or 'col'.")
+    frame = pd.DataFrame(columns, index=pd.Index(index, name=r_var))
+    frame.columns.name = c_var
+    return frame
+
+
+def cross(df, r_var, c_var, w=None, percent_by='row'):
+    '''
+    Cross table, see Table.cross. Column percents are weighted too.
+    :return pd.DataFrame.
+    '''
+    rc, rl = codes(df[r_var])
+    cc, cl = codes(df[c_var])
+    table = counts_2d(rc, len(rl), cc, len(cl), weight_array(df, w))
+    return layout_cross(table, rl, cl, r_var, c_var, w is not None, percent_by)
+
+
+def freq_batch(df, variables, w=None, label=None):
+    '''
+    Frequency tables of many variables, sharing one weight array.
+    :param label(dict): Optional. {variable: list of labels}.
+    :return dict {variable: pd.DataFrame}.
+    '''
+    label = label or {}
+    return {v: freq(df, v, w=w, label=label.get(v)) for v in variables}
+
+
+def cross_batch(df, rows, banner, w=None, percent_by='row'):
+    '''
+    Cross tables of many row variables against one banner variable.
+    The banner codes and the weights are computed once.
+    :param rows(list): The row variables.
+    :param banner(str): The column variable.
+    :return dict {row variable: pd.DataFrame}.
+    '''
+    cc, cl = codes(df[banner])
+    weights = weight_array(df, w)
+    result = {}
+    for r_var in rows:
+        rc, rl = codes(df[r_var])
+        table = counts_2d(rc, len(rl), cc, len(cl), weights)
+        result[r_var] = layout_cross(table, rl, cl, r_var, banner, w is not None, percent_by)
+    return result
@@ -0,0 +1,110 @@
+#!/usr/bin/python
+# -*- encoding: utf-8 -*-
+# File    :   batch.py
+# Description : Weight many survey waves / subgroups in a process pool against
+#               one set of population targets.
+
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from population import Population, load_population
+from weighting import weighting
+
+METHODS = ['post', 'raking', 'ipf']
+
+_population = None # Targets of the worker process, set once by _init_worker.
+
+
+def _init_worker(population):
+    global _population
+    _population = population
+
+
+def _weight_one(key, data, method, w_col, kwargs):
+    start = time.perf_counter()
+    w = weighting(data, population_path=_population, weight_col_name=w_col)
+    if method == 'post':
+        df = w.post_stratification(weight_col=w_col, **kwargs)
+    elif method == 'raking':
+        df = w.raking(w_col=w_col, **kwargs)
+    else:
+        df = w.raking_ipf(w_col=w_col, **kwargs)
+
+    stats = {'group': key, 'n': len(df), 'method': method,
+             'iterations': getattr(w, 'iterations', 0),
+             'converged': getattr(w, 'converged', True),
+             'max_dev': w.diagnostics['max_dev'].iloc[-1] if method == 'ipf' else np.nan,
+             'seconds': time.perf_counter() - start}
+    return key, df, stats
+
+
+def weight_batch(data, by=None, method='post', population_path='population.xlsx',
+                 w_col='weight', processes=None, key_name='dataset', **kwargs):
+    '''
+    Weight many datasets, or the groups of one dataset, in parallel.
+    ------------------------------------------------------------------
+    The population targets are parsed once in this process and handed to
+    every worker when it starts, so no worker reads population.xlsx.
+    :param data(pandas.DataFrame, list or dict): One dataset split by `by`,
+                 or many datasets as a list or {name: pandas.DataFrame}.
+    :param by(str): Optional. The column to split one dataset on, eg. wave ID.
+                    Rows with no value of by are weighted as a group of their own.
+    :param method(str): Optional. 'post' (post_stratification), 'raking' or
+                        'ipf' (raking_ipf). Defalt='post'
+    :param population_path(str or Population): Optional.
+                                               Defalt='population.xlsx'.
+    :param w_col(str): Optional. The name of the column of weight.
+    :param processes(int): Optional. Number of worker processes.
+                           Defalt=None, eg. os.cpu_count(); 1 runs in this process.
+    :param key_name(str): Optional. Column holding the name of each dataset
+                          when data is a list or dict. Defalt='dataset'
+    :param kwargs: Passed to post_stratification/raking/raking_ipf, eg. min_count,
+                   tol, max_iter.
+    :return (pandas.DataFrame, pandas.DataFrame): The combined weighted data
+            and one row of convergence statistics per group.
+    '''
+    if method not in METHODS:
+        raise ValueError(f'method must be one of {METHODS}.')
+    if isinstance(population_path, Population):
+        population = population_path
+    else:
+        population = load_population(population_path)
+
+    if isinstance(data, pd.DataFrame):
+        if by is None:
+            raise ValueError('by is required when data is one DataFrame.')
+        positions = data.groupby(by, sort=False, dropna=False).indices
+        tasks = [(key, data.iloc[pos]) for key, pos in positions.items()]
+    else:
+        items = data.items() if isinstance(data, dict) else enumerate(data)
+        tasks = [(key, df.assign(**{key_name: key})) for key, df in items]
+
+    processes = processes or os.cpu_count()
+    if processes == 1 or len(tasks) == 1:
+        _init_worker(population)
+        results = [_weight_one(key, df, method, w_col, kwargs) for key, df in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=min(processes, len(tasks)),
+                                 initializer=_init_worker,
+                                 initargs=(population,)) as pool:
+            futures = [pool.submit(_weight_one, key, df, method, w_col, kwargs)
+                       for key, df in tasks]
+            results = [f.result() for f in futures]
+
+    combined = pd.concat([df for _, df, _ in results])
+    if isinstance(data, pd.DataFrame):
+        # Results come back in the order of tasks; keys that went through a
+        # worker are not looked up, as a NaN key comes back as another NaN.
+        order = np.concatenate([positions[key] for key, _ in tasks])
+        combined = combined.iloc[np.argsort(order)]
+    stats = pd.DataFrame([s for _, _, s in results]).set_index('group')
+    return combined, stats
+
+
+if __name__ == '__main__':
+    data = pd.read_csv('testdata.csv', encoding='utf_8_sig')
+    data['wave'] = np.arange(len(data)) % 4
+    df, stats = weight_batch(data, by='wave', method='ipf', tol=1e-6)
+    print(stats)
@@ -0,0 +1,171 @@
+#!/usr/bin/python
+# -*- encoding: utf-8 -*-
+# File    :   benchmark.py
+# Description : Benchmark of the weighting stages on synthetic surveys drawn
+#               from the population targets, plus a check against the
+#               reference outputs data_post_weighted.csv / data_raking_weighted.csv.
+#
+# Usage: python benchmark.py --sizes 1000 10000 100000 1000000 --missing 0.02 --skew 0.3
+# The run fails (exit 1) when the reference outputs differ or `import weighting`
+# exceeds --import-budget or loads matplotlib, seaborn or statsmodels.
+
+import argparse
+import contextlib
+import io
+import json
+import subprocess
+import sys
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+from population import load_population, _cache
+from weighting import weighting, MARGIN_VARS
+
+
+def synthetic_survey(population, n, missing=0.0, skew=0.0, seed=0):
+    '''
+    Draw a synthetic survey from the population targets.
+    ------------------------------------------------------
+    SEX x AGE x AREA is drawn from the SAA ratios and EDU from the EDU ratios,
+    each tilted by a random lognormal factor so the sample misses the targets.
+    :param population(Population): The population targets.
+    :param n(int): Number of respondents.
+    :param missing(float): Optional. Share of -1 in every weighting variable.
+    :param skew(float): Optional. Sigma of the lognormal tilt, 0 = no skew.
+    :param seed(int): Optional. Seed of the random generator.
+    :return pandas.DataFrame with columns SEX, AGE, EDU, AREA.
+    '''
+    rng = np.random.default_rng(seed)
+    saa = population.saa
+    p = saa['ratio'].to_numpy() * rng.lognormal(0, skew, len(saa)) if skew else saa['ratio'].to_numpy()
+    cell = rng.choice(len(saa), size=n, p=p / p.sum())
+    data = pd.DataFrame({'SEX': saa['sex'].to_numpy()[cell],
+                         'AGE': saa['age'].to_numpy()[cell],
+                         'AREA': saa['area'].to_numpy()[cell]})
+
+    edu = population.margins['EDU']
+    p = edu['ratio'].to_numpy() * rng.lognormal(0, skew, len(edu)) if skew else edu['ratio'].to_numpy()
+    data['EDU'] = rng.choice(edu.index.to_numpy(), size=n, p=p / p.sum())
+
+    if missing:
+        for v in MARGIN_VARS:
+            data.loc[rng.random(n) < missing, v] = -1
+    return data[MARGIN_VARS]
+
+
+def measure(func):
+    '''
+    Run func once.
+    :return (result, seconds, peak MB of memory allocated while running).
+    '''
+    tracemalloc.start()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = func()
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] / 2**20
+    tracemalloc.stop()
+    return result, seconds, peak
+
+
+def bench_size(population, n, missing=0.0, skew=0.0, seed=0):
+    '''
+    Time every weighting stage on one synthetic survey.
+    :return list of dict (n, stage, seconds, peak_mb).
+    '''
+    data = synthetic_survey(population, n, missing=missing, skew=skew, seed=seed)
+    rows = []
+
+    def record(stage, func):
+        result, seconds, peak = measure(func)
+        rows.append({'n': n, 'stage': stage, 'seconds': seconds, 'peak_mb': peak})
+        return result
+
+    w = record('__init__', lambda: weighting(data, population_path=population))
+    record('stratified', w.stratified)
+    record('post_stratification', w.post_stratification)
+    w = weighting(data, population_path=population)
+    record('raking', w.raking)
+    record('chitest', lambda: [w.chitest(v) for v in MARGIN_VARS])
+    w = weighting(data, population_path=population)
+    record('raking_ipf', w.raking_ipf)
+    return rows
+
+
+def check_reference(population_path='population.xlsx', data_path='testdata.csv'):
+    '''
+    Compare the weights on testdata.csv with the committed reference outputs.
+    :return dict {reference file: max absolute weight difference}.
+    '''
+    data = pd.read_csv(data_path, encoding='utf_8_sig')
+    result = {}
+    for name, method in [('data_post_weighted.csv', 'post'), ('data_raking_weighted.csv', 'raking')]:
+        ref = pd.read_csv(name, encoding='utf_8_sig')
+        with contextlib.redirect_stdout(io.StringIO()):
+            w = weighting(data, population_path=population_path).weights(method)
+        result[name] = float(np.abs(w - ref['weight'].to_numpy()).max())
+    return result
+
+
+HEAVY_MODULES = ['matplotlib', 'seaborn', 'statsmodels']
+
+
+def check_import(repeat=5):
+    '''
+    Time `import weighting` in fresh interpreters.
+    :return (float best seconds, list of heavy modules loaded by the import).
+    '''
+    code = ('import sys, time; start = time.perf_counter(); import weighting; '
+            'print(time.perf_counter() - start); '
+            f'print(",".join(m for m in {HEAVY_MODULES!r} if m in sys.modules))')
+    best, loaded = float('inf'), []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True,
+                             check=True).stdout.splitlines()
+        best = min(best, float(out[0]))
+        loaded = [m for m in out[1].split(',') if m] if len(out) > 1 else []
+    return best, loaded
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark of the weighting program.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000, 1000000])
+    parser.add_argument('--missing', type=float, default=0.0, help='Share of -1 per variable.')
+    parser.add_argument('--skew', type=float, default=0.3, help='Sigma of the lognormal tilt.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--population', default='population.xlsx')
+    parser.add_argument('--tolerance', type=float, default=1e-9,
+                        help='Maximum weight difference against the reference outputs.')
+    parser.add_argument('--import-budget', type=float, default=1.5,
+                        help='Maximum seconds of `import weighting` in a fresh interpreter.')
+    parser.add_argument('--output', help='Optional JSON file of the results.')
+    args = parser.parse_args(argv)
+
+    import_seconds, heavy = check_import()
+    print(f'import weighting: {import_seconds:.3f}s, heavy modules loaded: {heavy or "none"}')
+    import_ok = import_seconds <= args.import_budget and not heavy
+
+    _cache.clear()
+    _, seconds, peak = measure(lambda: load_population(args.population))
+    rows = [{'n': 0, 'stage': 'load_population', 'seconds': seconds, 'peak_mb': peak}]
+    population = load_population(args.population)
+    for n in args.sizes:
+        rows += bench_size(population, n, missing=args.missing, skew=args.skew, seed=args.seed)
+
+    table = pd.DataFrame(rows)
+    print(table.to_string(index=False))
+    reference = check_reference(args.population)
+    ok = import_ok and all(v <= args.tolerance for v in reference.values())
+    for name, diff in reference.items():
+        print(f'{name}: max |diff| = {diff:.3g}')
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'args': vars(args), 'stages': rows, 'reference': reference,
+                       'import_seconds': import_seconds, 'heavy_modules': heavy, 'ok': ok}, f, indent=2)
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,240 @@
+#!/usr/bin/python
+# -*- encoding: utf-8 -*-
+# File    :   cli.py
+# Description : Command-line entry point of the weighting program.
+#               Reads only the weighting columns to compute the weights, then
+#               streams the rows to the output chunk by chunk, or writes just
+#               an ID + weight file. CSV, Parquet and Feather are supported
+#               (Parquet/Feather need pyarrow), by file extension.
+#
+# Usage: python cli.py post testdata.csv data_post_weighted.csv
+#        python cli.py raking survey.parquet weights.parquet --id RID --cells SAA
+#        python cli.py diagnostics data_raking_weighted.csv
+
+import argparse
+import os
+import numpy as np
+import pandas as pd
+from population import load_population
+from spec import WeightingSpec
+from weighting import weighting
+from instrument import Recorder
+
+FORMATS = {'.csv': 'csv', '.parquet': 'parquet', '.pq': 'parquet',
+           '.feather': 'feather', '.arrow': 'feather'}
+
+
+def file_format(path):
+    '''
+    Format of a file from its extension.
+    '''
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in FORMATS:
+        raise ValueError(f'Unknown file format {ext}, use one of {sorted(FORMATS)}.')
+    return FORMATS[ext]
+
+
+def read_columns(path, columns, encoding='utf_8_sig'):
+    '''
+    Read only the given columns of a file.
+    '''
+    fmt = file_format(path)
+    if fmt == 'parquet':
+        return pd.read_parquet(path, columns=columns)
+    if fmt == 'feather':
+        return pd.read_feather(path, columns=columns)
+    return pd.read_csv(path, usecols=columns, encoding=encoding)
+
+
+def iter_chunks(path, chunksize=100000, encoding='utf_8_sig'):
+    '''
+    Every row of a file, chunk by chunk. A Feather file is one chunk. CSV
+    cells are read as the strings in the file, so every chunk writes them
+    back unchanged whatever the values of the other chunks.
+    '''
+    fmt = file_format(path)
+    if fmt == 'parquet':
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize):
+            yield batch.to_pandas()
+    elif fmt == 'feather':
+        yield pd.read_feather(path)
+    else:
+        yield from pd.read_csv(path, chunksize=chunksize, encoding=encoding, dtype=str,
+                               keep_default_na=False)
+
+
+def write_chunks(chunks, path, encoding='utf_8_sig'):
+    '''
+    Write chunks of rows to one file as they come. A Feather file is written
+    at the end, as it cannot be appended to.
+    :return int number of rows written.
+    '''
+    fmt = file_format(path)
+    n = 0
+    if fmt == 'csv':
+        with open(path, 'w', encoding=encoding, newline='') as f:
+            for i, chunk in enumerate(chunks):
+                chunk.to_csv(f, header=i == 0, index=False)
+                n += len(chunk)
+    elif fmt == 'parquet':
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        writer = None
+        try:
+            for chunk in chunks:
+                if writer is None:
+                    table = pa.Table.from_pandas(chunk, preserve_index=False)
+                    writer = pq.ParquetWriter(path, table.schema)
+                else:
+                    table = pa.Table.from_pandas(chunk, schema=writer.schema, preserve_index=False)
+                writer.write_table(table)
+                n += len(chunk)
+        finally:
+            if writer is not None:
+                writer.close()
+    else:
+        frame = pd.concat(list(chunks), ignore_index=True)
+        frame.to_feather(path)
+        n = len(frame)
+    return n
+
+
+def compute_weights(args):
+    '''
+    Weights of the input file, reading only the weighting columns.
+    :return (numpy.ndarray weights, pandas.DataFrame the columns read, weighting).
+    '''
+    population = load_population(args.population)
+    spec = WeightingSpec.from_population(population)
+    columns = spec.names + ([args.id] if args.id else [])
+    data = read_columns(args.input, columns, encoding=args.encoding)
+    instrument = None
+    if args.log or args.verbose:
+        instrument = Recorder(log_path=args.log, echo=args.verbose)
+    w = weighting(data, population_path=population, weight_col_name=args.weight_col, lean=True,
+                  instrument=instrument)
+
+    if args.command == 'post':
+        weights = w.weights('post')
+    elif args.method == 'legacy':
+        weights = w.weights('raking', var=args.var)
+    elif args.method == 'calibration':
+        weights = w.weights('calibration', var=args.var, cells=args.cells, distance=args.distance,
+                            bounds=args.bounds, tol=1e-8 if args.tol is None else args.tol,
+                            max_iter=args.max_iter)
+    else:
+        trim = None if args.trim is None else tuple(None if t < 0 else t for t in args.trim)
+        weights = w.weights('ipf', var=args.var, cells=args.cells,
+                            tol=1e-4 if args.tol is None else args.tol,
+                            max_iter=args.max_iter, trim=trim, trim_relative=args.trim_relative)
+    return weights, data, w
+
+
+def write_output(args, weights, data):
+    '''
+    Write ID + weight, or every column of the input plus the weight, streamed
+    chunk by chunk in the order of the input.
+    :return int number of rows written.
+    '''
+    if args.id:
+        frame = pd.DataFrame({args.id: data[args.id].to_numpy(), args.weight_col: weights})
+        return write_chunks([frame], args.output, encoding=args.encoding)
+
+    def weighted():
+        start = 0
+        for chunk in iter_chunks(args.input, chunksize=args.chunksize, encoding=args.encoding):
+            chunk[args.weight_col] = weights[start:start + len(chunk)]
+            start += len(chunk)
+            yield chunk
+    return write_chunks(weighted(), args.output, encoding=args.encoding)
+
+
+def diagnostics(data, population, w_col='weight'):
+    '''
+    Fit of weighted data to the population margins.
+    :return (pandas.DataFrame one row per variable with chi2, p and max_gap
+             (largest absolute gap of a weighted share to its ratio),
+             dict with n, deff and ess of the weights).
+    '''
+    w = weighting(data, population_path=population, weight_col_name=w_col, lean=True)
+    weights = data[w_col].to_numpy(dtype=float)
+    w.df[w_col] = weights
+    errors = w.margin_errors(w_col)
+    rows = []
+    for var in w.spec.names:
+        chi, p, _ = w.gof(var, w_col=w_col)
+        rows.append({'variable': var, 'chi2': chi, 'p': p, 'max_gap': errors[var]})
+    deff = len(weights) * np.square(weights).sum() / weights.sum() ** 2
+    return pd.DataFrame(rows).set_index('variable'), {'n': len(weights), 'deff': deff,
+                                                       'ess': len(weights) / deff}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Weighting of NTUWS survey data.')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    def common(p):
+        p.add_argument('input', help='Data file (.csv, .parquet or .feather).')
+        p.add_argument('--population', default='population.xlsx')
+        p.add_argument('--weight-col', default='weight')
+        p.add_argument('--encoding', default='utf_8_sig', help='Encoding of CSV files.')
+
+    def weighting_args(p):
+        common(p)
+        p.add_argument('output', help='Output file; its extension sets the format.')
+        p.add_argument('--id', help='Write only this ID column and the weight.')
+        p.add_argument('--chunksize', type=int, default=100000, help='Rows per output chunk.')
+        p.add_argument('--log', help='Optional JSON lines log of the stages and raking events.')
+        p.add_argument('--verbose', action='store_true', help='Print the raking progress.')
+
+    post = sub.add_parser('post', help='Post-stratification on SEX x AGE x AREA.')
+    weighting_args(post)
+
+    raking = sub.add_parser('raking', help='Raking on the margins.')
+    weighting_args(raking)
+    raking.add_argument('--method', choices=['ipf', 'legacy', 'calibration'], default='ipf',
+                        help='ipf: raking_ipf; legacy: the chi-square loop of raking(); '
+                             'calibration: all margins at once, see --distance.')
+    raking.add_argument('--distance', choices=['linear', 'raking', 'logit', 'truncated'],
+                        default='linear', help='Distance of --method calibration.')
+    raking.add_argument('--bounds', type=float, nargs=2, metavar=('L', 'U'),
+                        help='Factor bounds of the logit and truncated distances.')
+    raking.add_argument('--var', nargs='+', default=['SEX', 'AGE', 'EDU', 'AREA'])
+    raking.add_argument('--cells', nargs='*', default=[], help='eg. SAA')
+    raking.add_argument('--tol', type=float,
+                        help='Maximum margin deviation; default 1e-4 (ipf) or 1e-8 (calibration).')
+    raking.add_argument('--max-iter', type=int, default=100)
+    raking.add_argument('--trim', type=float, nargs=2, metavar=('LOWER', 'UPPER'),
+                        help='Caps of the weights; a negative value means no cap.')
+    raking.add_argument('--trim-relative', action='store_true')
+    raking.add_argument('--diagnostics', help='Optional CSV file of the per-sweep record (ipf).')
+
+    diag = sub.add_parser('diagnostics', help='Fit of a weighted file to the population.')
+    common(diag)
+    diag.add_argument('--output', help='Optional CSV file of the table.')
+    args = parser.parse_args(argv)
+
+    if args.command == 'diagnostics':
+        population = load_population(args.population)
+        names = WeightingSpec.from_population(population).names
+        data = read_columns(args.input, names + [args.weight_col], encoding=args.encoding)
+        table, summary = diagnostics(data, population, w_col=args.weight_col)
+        print(table.to_string())
+        print(', '.join(f'{k} = {v:.4g}' for k, v in summary.items()))
+        if args.output:
+            table.to_csv(args.output, encoding='utf_8_sig')
+        return 0
+
+    weights, data, w = compute_weights(args)
+    n = write_output(args, weights, data)
+    print(f'已寫出{n}筆權數至{args.output}')
+    if w.instrument.enabled:
+        w.instrument.close()
+    if getattr(args, 'diagnostics', None) and hasattr(w, 'diagnostics'):
+        w.diagnostics.to_csv(args.diagnostics, encoding='utf_8_sig')
+    return 0 if getattr(w, 'converged', True) else 1
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
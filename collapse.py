@@ -0,0 +1,113 @@
+#!/usr/bin/python
+# -*- encoding: utf-8 -*-
+# File    :   collapse.py
+# Description : Collapsing of sparse or empty post-stratification cells.
+#               Cells below a minimum count are merged with an adjacent cell
+#               along a configurable hierarchy of axes (eg. AGE first, then
+#               AREA) until every merged cell has enough respondents. The plan
+#               is computed on the strata table, never per row, and cached by
+#               sparsity pattern so waves with the same empty cells reuse it.
+
+import numpy as np
+
+_plans = {} # (shape, hierarchy, min_count, ratio, sparsity pattern) -> (group, unresolved groups).
+
+
+def needs_merge(count, ratio, min_count):
+    '''
+    A group needs merging if it is below min_count and either holds
+    respondents or a population share, or holds respondents but no share.
+    '''
+    return (count < min_count and (count > 0 or ratio > 0)) or (count > 0 and ratio <= 0)
+
+
+def unresolved(group, counts, ratio, min_count=1):
+    '''
+    The groups of a plan that still need a merge for these counts.
+    :return set of group numbers.
+    '''
+    n = np.bincount(group.ravel(), weights=counts.ravel())
+    r = np.bincount(group.ravel(), weights=np.nan_to_num(ratio).ravel())
+    return {g for g, (c, q) in enumerate(zip(n, r)) if needs_merge(c, q, min_count)}
+
+
+def collapse_plan(counts, ratio, hierarchy, min_count=1):
+    '''
+    Merge sparse cells of a strata table into groups.
+    ---------------------------------------------------
+    The group with the fewest respondents that needs a merge (see
+    needs_merge) is merged with the smallest adjacent group along the first
+    axis of hierarchy that has one, then the next, until no group needs a
+    merge or none can be merged. Two cells are adjacent along an axis if they
+    agree on every other axis and are neighbours in the order of that axis.
+    :param counts(numpy.ndarray): (Weighted) respondents of every stratum.
+    :param ratio(numpy.ndarray): Population ratio of every stratum, NaN for
+                                 strata absent in the population.
+    :param hierarchy(list): (axis, order) in order of preference; order lists
+                            the positions of the levels of the axis in their
+                            adjacency order, eg. (1, [0, 1, 2, 3, 4, 5, 6]).
+    :param min_count(float): Optional. Minimum respondents of a group. Defalt=1
+    :return numpy.ndarray of the group of every stratum, numbered 0, 1, ...
+            in order of first cell.
+    '''
+    shape = counts.shape
+    ratio = np.nan_to_num(ratio)
+    group = np.arange(counts.size).reshape(shape)
+    n = dict(enumerate(counts.ravel().astype(float)))
+    r = dict(enumerate(ratio.ravel()))
+
+    neighbours = {}
+    for axis, order in hierarchy:
+        rank = np.empty(shape[axis], dtype=int)
+        rank[list(order)] = np.arange(len(order))
+        neighbours[axis] = (np.asarray(order), rank)
+
+    blocked = set()
+    while True:
+        todo = [g for g in n if g not in blocked and needs_merge(n[g], r[g], min_count)]
+        if not todo:
+            break
+        g = min(todo, key=lambda k: (n[k], k))
+        cells = np.argwhere(group == g)
+        target = None
+        for axis, _ in hierarchy:
+            order, rank = neighbours[axis]
+            found = set()
+            for cell in cells:
+                for step in (-1, 1):
+                    k = rank[cell[axis]] + step
+                    if 0 <= k < len(order):
+                        other = cell.copy()
+                        other[axis] = order[k]
+                        found.add(int(group[tuple(other)]))
+            found.discard(g)
+            if found:
+                target = min(found, key=lambda k: (n[k], k))
+                break
+        if target is None:
+            blocked.add(g)
+            continue
+        group[group == g] = target
+        n[target] += n.pop(g)
+        r[target] += r.pop(g)
+        blocked.clear()
+
+    return np.unique(group.ravel(), return_inverse=True)[1].reshape(shape)
+
+
+def cached_plan(counts, ratio, hierarchy, min_count=1):
+    '''
+    collapse_plan, reusing the plan of an earlier table with the same cells
+    below min_count when it leaves no more groups unresolved for these counts
+    than it did for the table it was made for.
+    '''
+    hierarchy = tuple((axis, tuple(order)) for axis, order in hierarchy)
+    key = (counts.shape, hierarchy, min_count, ratio.tobytes(),
+           np.packbits(counts < min_count).tobytes(), np.packbits(counts > 0).tobytes())
+    if key in _plans:
+        group, left = _plans[key]
+        if unresolved(group, counts, ratio, min_count) <= left:
+            return group
+    group = collapse_plan(counts, ratio, hierarchy, min_count)
+    _plans[key] = (group, unresolved(group, counts, ratio, min_count))
+    return group
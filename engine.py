@@ -0,0 +1,464 @@
+#!/usr/bin/python
+# -*- encoding: utf-8 -*-
+# File    :   engine.py
+# Description : Array kernels of the weighting program. Respondents are
+#               collapsed into a contingency table of cell codes and every
+#               weighting method runs on that table.
+#
+# A contingency table has one axis per weighting variable; the last level of
+# every axis holds the missing (-1 or unknown) values. A target is a pair
+# (axes, ratio): the sorted axes it cross-classifies and the population ratio
+# of every non-missing cell of those axes, eg. ((1,), AGE ratios) for a margin
+# or ((0, 1, 3), SEX x AGE x AREA ratios) for the SAA strata.
+
+import time
+import numpy as np
+from scipy.special import chdtrc
+
+
+def level_positions(levels, values):
+    '''
+    Position of every value among the sorted population levels.
+    :param levels(numpy.ndarray): The sorted levels of a weighting variable.
+    :param values(numpy.ndarray): The observed values.
+    :return numpy.ndarray of int, -1 for missing or unknown values.
+    '''
+    pos = np.minimum(np.searchsorted(levels, values), len(levels) - 1)
+    return np.where(levels[pos] == values, pos, -1)
+
+
+def cell_codes(values, levels):
+    '''
+    Mixed-radix code of the cross-classified cell of every respondent.
+    Every variable gets one extra, last level for -1 and unknown values.
+    :param values(list): numpy.ndarray of the observed values of every variable.
+    :param levels(list): numpy.ndarray of the sorted levels of every variable.
+    :return (numpy.ndarray code, tuple shape of the contingency table).
+    '''
+    code = np.zeros(len(values[0]) if values else 0, dtype=np.int64)
+    for v, lv in zip(values, levels):
+        pos = level_positions(lv, v)
+        code = code * (len(lv) + 1) + np.where(pos >= 0, pos, len(lv))
+    return code, tuple(len(lv) + 1 for lv in levels)
+
+
+def group_sums(code, weights=None, minlength=0, deterministic=False):
+    '''
+    Sum of the weights of every code, like numpy.bincount.
+    :param deterministic(bool): Optional. Add the weights of every code in
+                                ascending order of value with pairwise float64
+                                summation, so the sums are bit-identical for any
+                                order of the rows; costs a sort. Defalt=False
+    :return numpy.ndarray of float.
+    '''
+    if weights is None or not deterministic:
+        return np.bincount(code, weights=weights, minlength=minlength).astype(float)
+    order = np.lexsort((weights, code))
+    w = np.asarray(weights, dtype=float)[order]
+    bounds = np.searchsorted(code[order], np.arange(max(minlength, code.max(initial=-1) + 1) + 1))
+    return np.array([w[a:b].sum() for a, b in zip(bounds[:-1], bounds[1:])])
+
+
+def cell_counts(code, shape, weights=None, deterministic=False):
+    '''
+    Contingency table of the cell codes.
+    :param deterministic(bool): Optional. See group_sums. Defalt=False
+    :return numpy.ndarray of the given shape with the (weighted) counts.
+    '''
+    return group_sums(code, weights, int(np.prod(shape)), deterministic).reshape(shape)
+
+
+def target_totals(table, axes):
+    '''
+    Totals of the non-missing cells of the given axes of a contingency table.
+    '''
+    other = tuple(i for i in range(table.ndim) if i not in axes)
+    return table.sum(axis=other)[tuple(slice(None, -1) for _ in axes)]
+
+
+def broadcast_target(values, axes, shape, fill):
+    '''
+    Pad an array over the non-missing cells of axes with fill for the missing
+    levels, shaped to broadcast against a table of the given shape.
+    '''
+    full = np.full([shape[a] for a in axes], fill, dtype=float)
+    full[tuple(slice(None, -1) for _ in axes)] = values
+    return full.reshape([shape[i] if i in axes else 1 for i in range(len(shape))])
+
+
+def max_deviation(table, targets):
+    '''
+    Largest absolute gap between a weighted share and its population ratio.
+    '''
+    max_dev = 0.0
+    for axes, ratio in targets:
+        totals = target_totals(table, axes)
+        max_dev = max(max_dev, np.nanmax(np.abs(totals / totals.sum() - ratio)))
+    return max_dev
+
+
+def weighted_median(values, weights):
+    '''
+    Median of values with frequency weights.
+    '''
+    order = np.argsort(values)
+    cum = np.cumsum(weights[order])
+    return values[order][np.searchsorted(cum, cum[-1] / 2)]
+
+
+def kish_deff(counts, g):
+    '''
+    Kish design effect n * sum(w^2) / sum(w)^2 of a table, counts being the
+    number of respondents of every cell and g their weight.
+    :return (float deff, float effective sample size).
+    '''
+    n = counts.sum()
+    w1 = (counts * g).sum()
+    w2 = (counts * g * g).sum()
+    return n * w2 / w1 ** 2, w1 ** 2 / w2
+
+
+def trim_factors(counts, g, lower=None, upper=None, max_pass=20):
+    '''
+    Cap the cell factors to [lower, upper] (numbers or one cap per cell) and spread the trimmed weight over
+    the cells within the caps, so the weighted total is unchanged.
+    :return numpy.ndarray of the trimmed factors.
+    '''
+    g = g.copy()
+    occupied = counts > 0
+    total = (counts * g).sum()
+    for _ in range(max_pass):
+        np.clip(g, lower, upper, out=g)
+        free = occupied.copy()
+        if lower is not None:
+            free &= g > lower
+        if upper is not None:
+            free &= g < upper
+        excess = total - (counts * g).sum()
+        if abs(excess) <= 1e-12 * total or not free.any():
+            break
+        g[free] *= 1 + excess / (counts * g)[free].sum()
+    return g
+
+
+def mean_weights(counts, respondents=None):
+    '''
+    Mean starting weight of every cell, counts / respondents, 1 for empty
+    cells or when respondents is None (counts are then numbers of respondents).
+    '''
+    if respondents is None:
+        return np.ones(counts.shape)
+    return np.divide(counts, respondents, out=np.ones(counts.shape), where=respondents > 0)
+
+
+def rake_cells(counts, targets, tol=1e-4, rel_tol=None, max_iter=100, factor=None,
+               trim=None, trim_relative=False, respondents=None):
+    '''
+    Iterative proportional fitting on a contingency table.
+    --------------------------------------------------------
+    Every respondent in a cell gets the same multiplicative factor, so the
+    iteration only touches the table and its cost does not depend on the
+    number of respondents. Stopping rules are those of weighting.raking_ipf.
+    Target cells with a NaN ratio are left unadjusted.
+    :param counts(numpy.ndarray): (Weighted) cell counts from cell_counts.
+    :param targets(list): (axes, ratio) of every margin or cross-classified target.
+    :param factor(numpy.ndarray): Optional. Starting cell factors.
+                                  Defalt=None, eg. all 1.
+    :param trim(tuple): Optional. (lower, upper) caps of the weights, either
+                        may be None; applied with redistribution at the end of
+                        every sweep (see trim_factors). The weight of a cell is
+                        its mean starting weight times its factor, which is
+                        the weight of every respondent of the cell only when
+                        their starting weights are equal. Defalt=None
+    :param trim_relative(bool): Optional. The caps are multiples of the
+                                median weight. Defalt=False
+    :param respondents(numpy.ndarray): Optional. Number of respondents of every
+                                       cell when counts are weighted.
+                                       Defalt=None, eg. counts.
+    :return (numpy.ndarray factor, list of dict per-sweep diagnostics, bool converged).
+            w_min and w_max in the diagnostics are the range of the mean
+            weights of the occupied cells; deff and ess are the Kish design
+            effect and effective sample size of those weights.
+    '''
+    g = np.ones(counts.shape) if factor is None else factor.astype(float, copy=True)
+    n = counts if respondents is None else respondents
+    base = mean_weights(counts, respondents)
+    occupied = counts > 0
+    records = []
+    converged = False
+    for r in range(1, max_iter + 1):
+        start = time.perf_counter()
+        g_old = g.copy()
+        for axes, ratio in targets:
+            totals = target_totals(counts * g, axes)
+            f = np.ones(totals.shape)
+            np.divide(ratio * totals.sum(), totals, out=f, where=(totals > 0) & ~np.isnan(ratio))
+            g *= broadcast_target(f, axes, counts.shape, 1.0)
+        if trim is not None:
+            lower, upper = trim
+            if trim_relative:
+                median = weighted_median((base * g)[occupied], n[occupied])
+                lower = None if lower is None else lower * median
+                upper = None if upper is None else upper * median
+            g = trim_factors(counts, g, None if lower is None else lower / base,
+                             None if upper is None else upper / base)
+
+        max_dev = max_deviation(counts * g, targets)
+        max_change = np.max(np.abs(g - g_old)[occupied] / g_old[occupied])
+        w = base * g
+        deff, ess = kish_deff(n, w)
+        records.append({'iteration': r, 'max_dev': max_dev, 'max_change': max_change,
+                        'seconds': time.perf_counter() - start,
+                        'w_min': w[occupied].min(), 'w_max': w[occupied].max(),
+                        'deff': deff, 'ess': ess})
+
+        if max_dev <= tol or (rel_tol is not None and max_change <= rel_tol):
+            converged = True
+            break
+    return g, records, converged
+
+
+def calibration_matrix(shape, targets):
+    '''
+    Calibration variables of every cell of a contingency table.
+    ---------------------------------------------------------------
+    A share target "weighted share of level k among the non-missing = ratio_k"
+    is the linear constraint sum_c w_c * (I_k(c) - ratio_k * m_c) = 0, m_c being
+    1 for cells not missing on the target axes. The first column is 1 for every
+    cell, fixing the total. Levels with a NaN ratio have no constraint.
+    :return numpy.ndarray (number of cells, number of constraints).
+    '''
+    idx = np.indices(shape).reshape(len(shape), -1)
+    columns = [np.ones((idx.shape[1], 1))]
+    for axes, ratio in targets:
+        sub = [idx[a] for a in axes]
+        valid = np.all([s < shape[a] - 1 for s, a in zip(sub, axes)], axis=0)
+        flat = np.ravel_multi_index([np.where(valid, s, 0) for s in sub], ratio.shape)
+        z = np.zeros((idx.shape[1], ratio.size))
+        z[np.flatnonzero(valid), flat[valid]] = 1.0
+        z -= valid[:, np.newaxis] * np.nan_to_num(ratio.ravel())
+        columns.append(z[:, ~np.isnan(ratio.ravel())])
+    return np.hstack(columns)
+
+
+def distance_function(distance, bounds=None):
+    '''
+    Calibration function F and its derivative, F(0) = 1, of a distance.
+    :param distance(str): 'linear' (GREG), 'raking' (exponential; matches
+                          rake_cells only when no cell is missing a target
+                          variable, as the missing are calibrated differently),
+                          'logit' (bounded in (L, U)) or 'truncated' (linear,
+                          clipped to [L, U]).
+    :param bounds(tuple): (L, U) of 'logit' and 'truncated', L < 1 < U.
+    :return (F, dF).
+    '''
+    if distance == 'linear':
+        return lambda u: 1 + u, lambda u: np.ones_like(u)
+    if distance == 'raking':
+        return np.exp, np.exp
+    if bounds is None:
+        raise ValueError(f"distance '{distance}' needs bounds (L, U).")
+    lower, upper = bounds
+    if distance == 'truncated':
+        lo = -np.inf if lower is None else lower
+        hi = np.inf if upper is None else upper
+        return (lambda u: np.clip(1 + u, lo, hi),
+                lambda u: ((1 + u > lo) & (1 + u < hi)).astype(float))
+    if distance == 'logit':
+        if not lower < 1 < upper:
+            raise ValueError('logit bounds must satisfy L < 1 < U.')
+        a = (upper - lower) / ((1 - lower) * (upper - 1))
+
+        def F(u):
+            e = np.exp(np.clip(a * u, -700, 700))
+            return (lower * (upper - 1) + upper * (1 - lower) * e) / ((upper - 1) + (1 - lower) * e)
+
+        def dF(u):
+            h = np.exp(np.clip(a * u / 2, -350, 350)) # e / (c + d e)^2 = 1 / (c / h + d h)^2
+            return a * (upper - lower) * (1 - lower) * (upper - 1) / ((upper - 1) / h + (1 - lower) * h) ** 2
+        return F, dF
+    raise ValueError("distance must be 'linear', 'raking', 'logit' or 'truncated'.")
+
+
+def calibrate_cells(counts, targets, distance='linear', bounds=None, tol=1e-8, max_iter=50,
+                    respondents=None):
+    '''
+    Calibration (GREG and its bounded variants) on a contingency table.
+    ----------------------------------------------------------------------
+    Solves every target at once for factors g_c = F(z_c' lambda) by Newton
+    steps on the small system of calibration variables (see
+    calibration_matrix), so the cost depends on the number of cells and
+    constraints, not on the number of respondents. The linear distance is
+    solved in one step; the others usually take a handful. Redundant
+    constraints (eg. SAA cells with the SEX margin) are handled by a least
+    squares step.
+    :param counts(numpy.ndarray): (Weighted) cell counts from cell_counts.
+    :param targets(list): (axes, ratio) of every target, as in rake_cells.
+    :param distance(str), bounds(tuple): See distance_function.
+    :param tol(float): Optional. Maximum absolute margin deviation. Defalt=1e-8
+    :param max_iter(int): Optional. Maximum number of Newton steps. Defalt=50
+    :param respondents(numpy.ndarray): Optional. See rake_cells.
+    :return (numpy.ndarray factor, list of dict per-step diagnostics, bool converged),
+            the diagnostics being those of rake_cells.
+    '''
+    F, dF = distance_function(distance, bounds)
+    n = counts if respondents is None else respondents
+    base = mean_weights(counts, respondents)
+    occupied = counts > 0
+    Z = calibration_matrix(counts.shape, targets)
+    Zo, d = Z[occupied.ravel()], counts[occupied]
+    total = np.zeros(Z.shape[1])
+    total[0] = d.sum()
+    lam = np.zeros(Z.shape[1])
+    g = np.ones(counts.shape)
+    records = []
+    converged = False
+    residual = lambda lam: total - Zo.T @ (d * F(Zo @ lam))
+    resid = residual(lam)
+    for r in range(1, max_iter + 1):
+        start = time.perf_counter()
+        jacobian = (Zo * (d * dF(Zo @ lam))[:, np.newaxis]).T @ Zo
+        step = np.linalg.lstsq(jacobian, resid, rcond=None)[0]
+        # Halve the step while it does not reduce the residual, as a full
+        # Newton step can overshoot into the flat tails of a bounded F.
+        norm = np.linalg.norm(resid)
+        for _ in range(30):
+            new = residual(lam + step)
+            if np.linalg.norm(new) < norm:
+                break
+            step /= 2
+        lam, resid = lam + step, new
+        g = F(Z @ lam).reshape(counts.shape)
+
+        max_dev = max(max_deviation(counts * g, targets),
+                      abs((counts * g).sum() / total[0] - 1))
+        w = base * g
+        deff, ess = kish_deff(n, w)
+        records.append({'iteration': r, 'max_dev': max_dev,
+                        'seconds': time.perf_counter() - start,
+                        'w_min': w[occupied].min(), 'w_max': w[occupied].max(),
+                        'deff': deff, 'ess': ess})
+        if max_dev <= tol:
+            converged = True
+            break
+    return g, records, converged
+
+
+def batch_totals(table, axes):
+    '''
+    target_totals of every table of a batch, the batch being axis 0.
+    '''
+    other = tuple(i + 1 for i in range(table.ndim - 1) if i not in axes)
+    return table.sum(axis=other)[(slice(None),) + tuple(slice(None, -1) for _ in axes)]
+
+
+def rake_cells_batch(counts, targets, tol=1e-4, max_iter=100):
+    '''
+    Iterative proportional fitting of a batch of contingency tables at once.
+    --------------------------------------------------------------------------
+    Used for replicate weights (one table per replicate, same ratios) and for
+    scenarios (one table, one ratio set per scenario).
+    :param counts(numpy.ndarray): Shape (K, *table shape), or (1, *table shape)
+                                  to share one table over the batch.
+    :param targets(list): (axes, ratio) as in rake_cells; axes count from the
+                          table axes and ratio is either shared or has a
+                          leading axis of length K.
+    :return (numpy.ndarray factor of shape (K, *table shape),
+             list of dict per-sweep diagnostics, bool converged).
+            max_dev is the largest over the batch.
+    '''
+    shape = counts.shape[1:]
+    k = max([counts.shape[0]] + [r.shape[0] for a, r in targets if r.ndim > len(a)])
+    g = np.ones((k,) + shape)
+    records = []
+    converged = False
+    for r in range(1, max_iter + 1):
+        start = time.perf_counter()
+        for axes, ratio in targets:
+            totals = batch_totals(counts * g, axes)
+            n = totals.reshape(k, -1).sum(axis=1).reshape((k,) + (1,) * len(axes))
+            f = np.ones(totals.shape)
+            np.divide(ratio * n, totals, out=f, where=(totals > 0) & ~np.isnan(ratio * n))
+            full = np.ones((k,) + tuple(shape[a] for a in axes))
+            full[(slice(None),) + tuple(slice(None, -1) for _ in axes)] = f
+            g *= full.reshape((k,) + tuple(shape[i] if i in axes else 1 for i in range(len(shape))))
+
+        max_dev = 0.0
+        for axes, ratio in targets:
+            totals = batch_totals(counts * g, axes)
+            n = totals.reshape(k, -1).sum(axis=1).reshape((k,) + (1,) * len(axes))
+            max_dev = max(max_dev, np.nanmax(np.abs(totals / n - ratio)))
+        records.append({'iteration': r, 'max_dev': max_dev,
+                        'seconds': time.perf_counter() - start})
+        if max_dev <= tol:
+            converged = True
+            break
+    return g, records, converged
+
+
+def post_cells(counts, axes, ratio, group=None):
+    '''
+    Post-stratification factor of every cell of a contingency table.
+    ------------------------------------------------------------------
+    A stratum of the target gets ratio * n / n_stratum, where n counts every
+    respondent. Cells with a missing stratum variable or an empty or unknown
+    stratum get NaN.
+    :param counts(numpy.ndarray): (Weighted) cell counts from cell_counts.
+    :param axes(tuple): The axes crossed into the strata.
+    :param ratio(numpy.ndarray): Population ratio of every stratum.
+    :param group(numpy.ndarray): Optional. Collapsed group of every stratum
+                                 (see collapse.collapse_plan); the strata of a
+                                 group share its summed ratio and respondents.
+                                 Defalt=None, eg. no collapsing.
+    :return numpy.ndarray of the same shape as counts.
+    '''
+    strata = target_totals(counts, axes)
+    if group is not None:
+        n_group = np.bincount(group.ravel(), weights=strata.ravel())
+        ratio_group = np.bincount(group.ravel(), weights=np.nan_to_num(ratio).ravel())
+        strata = n_group[group]
+        ratio = np.where(ratio_group[group] > 0, ratio_group[group], np.nan)
+    w = np.full(strata.shape, np.nan)
+    np.divide(ratio * counts.sum(), strata, out=w, where=strata > 0)
+    return np.broadcast_to(broadcast_target(w, axes, counts.shape, np.nan), counts.shape).copy()
+
+
+def gof_totals(obs, ratio, dof=None, decimals=None):
+    '''
+    Chi-square goodness of fit of observed totals against population ratios.
+    :param obs(numpy.ndarray): Weighted totals of every level or cell.
+    :param ratio(numpy.ndarray): Population ratio of every level or cell.
+    :param dof(int): Optional. Degrees of freedom.
+                     Defalt=None, eg. number of cells - 1.
+    :param decimals(int): Optional. Round the weighted totals before testing.
+                          Defalt=None, eg. unrounded.
+    :return (float chi2, float p, numpy.ndarray Pearson residual of every cell).
+    '''
+    n = obs.sum()
+    if decimals is not None:
+        obs, n = np.round(obs, decimals), np.round(n, decimals)
+    exp = n * ratio
+    residuals = (obs - exp) / np.sqrt(exp)
+    chi = np.square(residuals).sum() # 手算才是王道啦eo4!
+    p = chdtrc(ratio.size - 1 if dof is None else dof, chi) # chi2.sf without the rv_continuous overhead
+    return chi, p, residuals
+
+
+def chisq_gof(pos, w, ratio, dof=None, decimals=None, deterministic=False):
+    '''
+    Weighted chi-square goodness of fit against population ratios.
+    -----------------------------------------------------------------
+    :param pos(numpy.ndarray): Level position of every respondent, -1 if missing
+                               (see level_positions).
+    :param w(numpy.ndarray): The weights.
+    :param ratio(numpy.ndarray): Population ratio of every level.
+    :param dof(int): Optional. Degrees of freedom.
+                     Defalt=None, eg. len(ratio) - 1.
+    :param decimals(int): Optional. Round the weighted totals before testing.
+                          Defalt=None, eg. unrounded.
+    :param deterministic(bool): Optional. See group_sums. Defalt=False
+    :return (float chi2, float p, numpy.ndarray Pearson residual of every level).
+    '''
+    valid = pos >= 0
+    obs = group_sums(pos[valid], w[valid], len(ratio), deterministic)
+    return gof_totals(obs, ratio, dof=dof, decimals=decimals)
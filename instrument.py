@@ -0,0 +1,116 @@
+#!/usr/bin/python
+# -*- encoding: utf-8 -*-
+# File    :   instrument.py
+# Description : Instrumentation of the weighting pipeline. The weighting code
+#               reports stages (timed, optionally with peak memory) and events
+#               (raking rounds, convergence, margin errors) to an instrument.
+#               The default NULL instrument does nothing; Recorder keeps the
+#               events, calls callbacks, writes a JSON lines log and can print
+#               the usual progress messages.
+
+import contextlib
+import json
+import time
+import tracemalloc
+import pandas as pd
+
+MESSAGES = {'round': '第{round}輪加權',
+            'converged': 'Raking至第{iterations}輪收斂',
+            'not_converged': 'Raking於第{iterations}輪未收斂, max_dev = {max_dev}'}
+
+_NULL_STAGE = contextlib.nullcontext()
+
+
+class Instrument:
+    '''
+    The no-op instrument, the default of weighting. Callers check enabled
+    before computing anything that is only reported.
+    '''
+    enabled = False
+
+    def event(self, name, **fields):
+        pass
+
+    def stage(self, name, **fields):
+        return _NULL_STAGE
+
+
+NULL = Instrument()
+
+
+class Recorder(Instrument):
+    enabled = True
+
+    def __init__(self, callbacks=[], log_path=None, memory=False, echo=False):
+        '''
+        Record the stages and events of a weighting job.
+        --------------------------------------------------
+        :param callbacks(list): Optional. Functions called with every event,
+                                a dict with event, time (seconds since the
+                                recorder started) and the fields of the event.
+                                Defalt=[]
+        :param log_path(str): Optional. Append every event to this file as one
+                              JSON object per line. Defalt=None
+        :param memory(bool): Optional. Trace the peak Python memory of every
+                             stage with tracemalloc, which slows the stages
+                             down. Defalt=False
+        :param echo(bool): Optional. Print the progress messages of
+                           raking / raking_ipf. Defalt=False
+        '''
+        self.callbacks = list(callbacks)
+        self.log = open(log_path, 'a', encoding='utf-8') if log_path else None
+        self.memory = memory
+        self.echo = echo
+        self.events = []
+        self.start = time.perf_counter()
+
+    def event(self, name, **fields):
+        record = {'event': name, 'time': time.perf_counter() - self.start, **fields}
+        self.events.append(record)
+        for callback in self.callbacks:
+            callback(record)
+        if self.log is not None:
+            self.log.write(json.dumps(record, default=float, ensure_ascii=False) + '\n')
+            self.log.flush()
+        if self.echo and name in MESSAGES:
+            print(MESSAGES[name].format(**fields))
+
+    @contextlib.contextmanager
+    def stage(self, name, **fields):
+        '''
+        Time a block and report it as a 'stage' event with stage, seconds and
+        peak_mb (None unless memory=True).
+        '''
+        started = False
+        if self.memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                started = True
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            peak = None
+            if self.memory:
+                peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+                if started:
+                    tracemalloc.stop()
+            self.event('stage', stage=name, seconds=seconds, peak_mb=peak, **fields)
+
+    def stages(self):
+        '''
+        Total time, number of calls and largest peak memory of every stage.
+        :return pandas.DataFrame indexed by stage.
+        '''
+        df = pd.DataFrame([e for e in self.events if e['event'] == 'stage'],
+                          columns=['stage', 'seconds', 'peak_mb'])
+        return df.groupby('stage', sort=False).agg(calls=('seconds', 'size'),
+                                                   seconds=('seconds', 'sum'),
+                                                   peak_mb=('peak_mb', 'max'))
+
+    def close(self):
+        if self.log is not None:
+            self.log.close()
+            self.log = None
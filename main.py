@@ -9,6 +9,7 @@
 import os
 os.chdir(os.path.dirname(os.path.abspath(__file__)))
 from weighting import weighting
+from instrument import Recorder
 import pandas as pd
 import numpy as np
 
@@ -27,6 +28,7 @@ df.to_csv(os.path.join(output_path, output_name), encoding='utf_8_sig', index=Fa
 output_path = os.getcwd() # Output directory
 output_name = 'data_raking_weighted.csv' # Output data name
 
-df = weighting(df, population_path='population.xlsx').raking()
+log = Recorder(echo=True) # Print the raking rounds; log_path='raking.jsonl' keeps a JSON log
+df = weighting(df, population_path='population.xlsx', instrument=log).raking()
 df.to_csv(os.path.join(output_path, output_name), encoding='utf_8_sig', index=False)
 
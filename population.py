@@ -0,0 +1,135 @@
+#!/usr/bin/python
+# -*- encoding: utf-8 -*-
+# File    :   population.py
+# Description : Loader of the population targets (population.xlsx) with a
+#               memo keyed by file path and mtime and an optional npz sidecar.
+
+import os
+import numpy as np
+import pandas as pd
+
+MARGIN_SHEETS = ['SEX', 'AGE', 'EDU', 'AREA']
+SAA_COLUMNS = ['group', 'sex', 'age', 'area', 'ratio']
+
+_cache = {}
+
+
+class Population:
+    def __init__(self, saa, margins, path=None):
+        '''
+        Validated population targets.
+        -------------------------------
+        :param saa(pandas.DataFrame): The SAA sheet, indexed by 'index'.
+        :param margins(dict): {variable: pandas.DataFrame indexed by 'Value'
+                              with a 'ratio' column}, eg. the SEX, AGE, EDU
+                              and AREA sheets.
+        :param path(str): Optional. The file the targets were read from.
+        '''
+        self.saa = saa
+        self.margins = margins
+        self.path = path
+        self.validate()
+
+    def validate(self):
+        '''
+        Check the sheets before any weighting starts.
+        Raise ValueError if a column is missing, a ratio is out of [0, 1],
+        the ratios do not sum to 1, or an SAA cell uses an unknown level.
+        '''
+        missing = [c for c in SAA_COLUMNS if c not in self.saa.columns]
+        if missing:
+            raise ValueError(f'SAA sheet lacks columns {missing}.')
+        sheets = {'SAA': self.saa}
+        sheets.update(self.margins)
+        for name, sheet in sheets.items():
+            if 'ratio' not in sheet.columns:
+                raise ValueError(f'{name} sheet lacks column ratio.')
+            ratio = sheet['ratio'].to_numpy(dtype=float)
+            if np.isnan(ratio).any() or (ratio < 0).any() or (ratio > 1).any():
+                raise ValueError(f'{name} ratio must lie in [0, 1].')
+            if abs(ratio.sum() - 1) > 0.01:
+                raise ValueError(f'{name} ratio sums to {ratio.sum()}, not 1.')
+            if not sheet.index.is_unique:
+                raise ValueError(f'{name} sheet has duplicated index values.')
+        for var in ['SEX', 'AGE', 'AREA']:
+            if var in self.margins:
+                unknown = set(self.saa[var.lower()]) - set(self.margins[var].index)
+                if unknown:
+                    raise ValueError(f'SAA uses {var} levels {sorted(unknown)} not in sheet {var}.')
+
+    @classmethod
+    def from_excel(cls, path='population.xlsx'):
+        '''
+        Parse the whole workbook in one read.
+        '''
+        sheets = pd.read_excel(path, sheet_name=['SAA'] + MARGIN_SHEETS)
+        saa = sheets['SAA'].set_index('index')
+        margins = {s: sheets[s].set_index('Value') for s in MARGIN_SHEETS}
+        return cls(saa, margins, path=path)
+
+    def to_npz(self, path):
+        '''
+        Write the targets as a compact npz file (no pickled objects).
+        '''
+        arrays = {}
+        sheets = {'SAA': self.saa}
+        sheets.update(self.margins)
+        for name, sheet in sheets.items():
+            frame = sheet.reset_index()
+            arrays[f'{name}.columns'] = np.array(frame.columns, dtype=str)
+            arrays[f'{name}.index'] = np.array(sheet.index.name, dtype=str)
+            for col in frame.columns:
+                values = frame[col].to_numpy()
+                if values.dtype == object or not np.issubdtype(values.dtype, np.number):
+                    values = values.astype(str)
+                arrays[f'{name}__{col}'] = values
+        np.savez(path, **arrays)
+
+    @classmethod
+    def from_npz(cls, path):
+        '''
+        Read the targets written by Population.to_npz.
+        '''
+        with np.load(path, allow_pickle=False) as f:
+            sheets = {}
+            for name in ['SAA'] + MARGIN_SHEETS:
+                columns = f[f'{name}.columns'].tolist()
+                frame = pd.DataFrame({c: f[f'{name}__{c}'] for c in columns})
+                sheets[name] = frame.set_index(str(f[f'{name}.index']))
+        return cls(sheets['SAA'], {s: sheets[s] for s in MARGIN_SHEETS}, path=path)
+
+
+def load_population(path='population.xlsx', sidecar=False):
+    '''
+    Load the population targets once per process.
+    -----------------------------------------------
+    The parsed targets are memoized by (absolute path, mtime), so a changed
+    workbook is read again while repeated calls cost a dict lookup.
+    :param path(str): Optional.
+                      The path of the population data.
+                      Defalt='population.xlsx'.
+    :param sidecar(bool): Optional.
+                          Whether to keep a binary copy next to the workbook
+                          (path + '.npz'). A sidecar newer than the workbook is
+                          read instead of the workbook, otherwise it is rewritten.
+                          Defalt=False
+    :return Population.
+    '''
+    path = os.path.abspath(path)
+    key = (path, os.path.getmtime(path))
+    if key in _cache:
+        return _cache[key]
+
+    npz = path + '.npz'
+    if sidecar and os.path.exists(npz) and os.path.getmtime(npz) >= key[1]:
+        population = Population.from_npz(npz)
+    elif path.endswith('.npz'):
+        population = Population.from_npz(path)
+    else:
+        population = Population.from_excel(path)
+        if sidecar:
+            population.to_npz(npz)
+    population.path = path
+
+    _cache[key] = population
+    return population
@@ -0,0 +1,132 @@
+#!/usr/bin/python
+# -*- encoding: utf-8 -*-
+# File    :   replicate.py
+# Description : Bootstrap and delete-one-group jackknife replicate weights for
+#               variance estimation. All replicates are weighted together on
+#               their contingency tables, with no file I/O per replicate.
+
+import warnings
+import numpy as np
+import pandas as pd
+from engine import cell_counts, post_cells, rake_cells_batch
+from population import Population, load_population
+from spec import WeightingSpec
+
+
+def replicate_weights(data, B=100, method='bootstrap', groups=None, weighting='ipf',
+                      population_path='population.xlsx', spec=None, margins=None, cells=[],
+                      seed=0, tol=1e-6, max_iter=100, min_count=1, hierarchy=['AGE', 'AREA']):
+    '''
+    Replicate weights of a sample.
+    --------------------------------
+    :param data(pandas.DataFrame): Data holding every variable of spec.
+    :param B(int): Optional. Number of bootstrap replicates, or of random
+                   jackknife groups when groups is None. Defalt=100
+    :param method(str): Optional. 'bootstrap' (resample n of n with
+                        replacement) or 'jackknife' (delete one group).
+                        Defalt='bootstrap'
+    :param groups(str): Optional. Column of the jackknife groups, eg. PSU.
+                        Defalt=None, eg. B random groups.
+    :param weighting(str): Optional. 'ipf' (raking) or 'post'
+                           (post-stratification on the SAA strata). Defalt='ipf'
+    :param population_path(str or Population): Optional.
+                                               Defalt='population.xlsx'.
+    :param spec(WeightingSpec): Optional. Defalt=None, eg. that of the
+                                population data.
+    :param margins(list): Optional. Margin variables to rake on.
+    :param cells(list): Optional. Cells targets to rake on. Defalt=[]
+    :param seed(int): Optional. Seed of the random generator.
+    :param tol(float), max_iter(int): Optional. Stopping rule of the raking.
+    :param min_count(float), hierarchy(list): Optional. 'post' merges the strata
+                                              of a replicate with fewer (resampled)
+                                              respondents than min_count, see
+                                              WeightingSpec.collapse. Defalt=1,
+                                              eg. only the empty strata.
+    :return (numpy.ndarray full-sample weights, numpy.ndarray (n x B) float32
+             replicate weights).
+    '''
+    if isinstance(population_path, Population):
+        population = population_path
+    else:
+        population = load_population(population_path)
+    if spec is None:
+        spec = WeightingSpec.from_population(population)
+    if method not in ['bootstrap', 'jackknife']:
+        raise ValueError("method must be 'bootstrap' or 'jackknife'.")
+    if weighting not in ['ipf', 'post']:
+        raise ValueError("weighting must be 'ipf' or 'post'.")
+
+    rng = np.random.default_rng(seed)
+    code, shape = spec.codes(data)
+    n = len(code)
+    size = int(np.prod(shape))
+
+    if method == 'bootstrap':
+        # Only the seed of every draw is kept; the draw is made again when its
+        # weights are written.
+        seeds = np.random.SeedSequence(seed).spawn(B)
+        multiplier = lambda b: np.bincount(np.random.default_rng(seeds[b]).integers(0, n, n), minlength=n)
+        counts = np.stack([cell_counts(code, shape, weights=multiplier(b)) for b in range(B)])
+    else:
+        if groups is None:
+            group = rng.permutation(n) % B
+        else:
+            labels, group = np.unique(data[groups].to_numpy(), return_inverse=True)
+            B = len(labels)
+        scale = B / (B - 1)
+        multiplier = lambda b: np.where(group == b, 0.0, scale)
+        by_group = np.bincount(group * size + code, minlength=B * size).reshape((B,) + shape)
+        counts = (by_group.sum(axis=0) - by_group) * scale
+
+    full = cell_counts(code, shape)[np.newaxis]
+    if weighting == 'post':
+        cell = cells[0] if cells else 'SAA'
+        axes, ratio = spec.cell_target(cell)
+        factor = [post_cells(full[0], axes, ratio)]
+        for c in counts:
+            plan = spec.collapse(c, cell, min_count=min_count, hierarchy=hierarchy)
+            factor.append(post_cells(c, axes, ratio, group=plan))
+        factor = np.stack(factor)
+    else:
+        factor, records, converged = rake_cells_batch(np.concatenate([full, counts]),
+                                                      spec.targets(margins, cells),
+                                                      tol=tol, max_iter=max_iter)
+        if not converged:
+            warnings.warn(f'Replicate raking於第{len(records)}輪未收斂, max_dev = {records[-1]["max_dev"]}')
+    factor = factor.reshape(B + 1, -1)
+
+    replicates = np.empty((n, B), dtype=np.float32)
+    unweighted = 0
+    for b in range(B):
+        m = multiplier(b)
+        # A respondent left out of a replicate weighs 0, even in a stratum
+        # with no factor.
+        replicates[:, b] = np.where(m > 0, m * factor[b + 1, code], 0.0)
+        unweighted += np.isnan(replicates[:, b]).any()
+    if unweighted:
+        warnings.warn(f'{unweighted} of {B} replicates have respondents without a weight (NaN), '
+                      'in strata that could not be merged.')
+    return factor[0, code], replicates
+
+
+def replicate_variance(estimate, replicates, method='bootstrap'):
+    '''
+    Variance of an estimate from its replicate estimates.
+    :param estimate(float): The full-sample estimate.
+    :param replicates(numpy.ndarray): The estimate of every replicate.
+    :param method(str): Optional. 'bootstrap' or 'jackknife'.
+    :return float.
+    '''
+    sq = np.square(np.asarray(replicates, dtype=float) - estimate)
+    if method == 'jackknife':
+        return (len(sq) - 1) / len(sq) * sq.sum()
+    return sq.mean()
+
+
+if __name__ == '__main__':
+    data = pd.read_csv('testdata.csv', encoding='utf_8_sig')
+    w, rep = replicate_weights(data, B=200)
+    y = data['Vex'].str.contains('AZ').to_numpy()
+    est = np.average(y, weights=w)
+    se = np.sqrt(replicate_variance(est, [np.average(y, weights=rep[:, b]) for b in range(rep.shape[1])]))
+    print(f'AZ share = {est:.4f}, bootstrap s.e. = {se:.4f}')
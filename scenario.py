@@ -0,0 +1,88 @@
+#!/usr/bin/python
+# -*- encoding: utf-8 -*-
+# File    :   scenario.py
+# Description : Weight one sample against many population target sets at once,
+#               eg. several census years or registered voters vs adults. The
+#               sample is encoded and aggregated once and the raking of every
+#               scenario runs together on a (scenario x cells) array.
+
+import warnings
+import numpy as np
+import pandas as pd
+from engine import post_cells, rake_cells_batch
+from population import Population, load_population
+from spec import WeightingSpec
+
+
+def scenario_spec(population, names):
+    '''
+    WeightingSpec of a target set, restricted to names.
+    '''
+    if not isinstance(population, Population):
+        population = load_population(population)
+    return WeightingSpec.from_population(population, var=names)
+
+
+def scenario_weights(data, targets, method='ipf', spec=None, margins=None, cells=[],
+                     tol=1e-6, max_iter=100, prefix='weight_', dtype=np.float64):
+    '''
+    One weight column per population target set.
+    ----------------------------------------------
+    Every target set must use the levels of spec; only the ratios differ.
+    :param data(pandas.DataFrame): Data holding every variable of spec.
+    :param targets(dict): {scenario name: Population or path of a population file}.
+    :param method(str): Optional. 'ipf' (raking) or 'post' (post-stratification
+                        on cells[0], default 'SAA'). Defalt='ipf'
+    :param spec(WeightingSpec): Optional. The weighting variables.
+                                Defalt=None, eg. those of the first target set.
+    :param margins(list): Optional. Margin variables to rake on.
+                          Defalt=None, eg. every variable of spec.
+    :param cells(list): Optional. Cells targets to rake on. Defalt=[]
+    :param tol(float), max_iter(int): Optional. Stopping rule of the raking.
+    :param prefix(str): Optional. Prefix of the weight columns. Defalt='weight_'
+    :param dtype: Optional. numpy.float32 halves the memory of the weight
+                  columns. Defalt=numpy.float64
+    :return (pandas.DataFrame with a column prefix + name per scenario, indexed
+             like data, pandas.DataFrame of the per-sweep diagnostics
+             (max_dev over all scenarios; empty for 'post')).
+    '''
+    if method not in ['ipf', 'post']:
+        raise ValueError("method must be 'ipf' or 'post'.")
+    names = list(targets)
+    if spec is None:
+        spec = scenario_spec(targets[names[0]], None)
+    specs = [scenario_spec(targets[k], spec.names) for k in names]
+    for k, s in zip(names, specs):
+        for d in spec.dimensions:
+            if not np.array_equal(s[d.name].levels, d.levels):
+                raise ValueError(f'Scenario {k}: the levels of {d.name} differ from spec.')
+
+    code, shape = spec.codes(data)
+    counts = np.bincount(code, minlength=int(np.prod(shape))).reshape(shape).astype(float)
+
+    if method == 'post':
+        cell = cells[0] if cells else 'SAA'
+        factor = np.stack([post_cells(counts, *s.cell_target(cell)) for s in specs])
+        records = []
+    else:
+        per_scenario = [s.targets(margins, cells) for s in specs]
+        stacked = [(axes, np.stack([t[j][1] for t in per_scenario]))
+                   for j, (axes, _) in enumerate(per_scenario[0])]
+        factor, records, converged = rake_cells_batch(counts[np.newaxis], stacked,
+                                                      tol=tol, max_iter=max_iter)
+        if not converged:
+            warnings.warn(f'Scenario raking於第{len(records)}輪未收斂, max_dev = {records[-1]["max_dev"]}')
+
+    factor = factor.reshape(len(names), -1)
+    weights = pd.DataFrame(factor.astype(dtype)[:, code].T, columns=[prefix + str(k) for k in names],
+                           index=data.index)
+    return weights, pd.DataFrame(records, columns=['iteration', 'max_dev', 'seconds']).set_index('iteration')
+
+
+if __name__ == '__main__':
+    data = pd.read_csv('testdata.csv', encoding='utf_8_sig')
+    base = load_population('population.xlsx')
+    voters = Population(base.saa, {v: m.assign(ratio=np.roll(m['ratio'].to_numpy(), 1))
+                                   for v, m in base.margins.items()}, None)
+    w, diag = scenario_weights(data, {'adult': base, 'shifted': voters})
+    print(w.describe())
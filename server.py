@@ -0,0 +1,257 @@
+#!/usr/bin/python
+# -*- encoding: utf-8 -*-
+# File    :   server.py
+# Description : Local HTTP service of weighted estimates. The population
+#               targets and the datasets are loaded once and stay in memory;
+#               frequency / cross table / weighting requests are answered
+#               as JSON, with an LRU cache of results keyed on the dataset
+#               version and the query.
+#
+# Usage: python server.py --data testdata.csv --port 8765
+#        curl -d '{"dataset": "testdata", "var": "AGE", "w": "weight"}' localhost:8765/freq
+
+import argparse
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.request import Request, urlopen
+from AnalysisTool import tabulation
+from cli import read_columns
+from population import Population, load_population
+from weighting import weighting
+
+
+class StaleDataset(RuntimeError):
+    '''
+    The dataset was replaced while a request was working on it.
+    '''
+
+
+class WeightingService:
+    def __init__(self, population_path='population.xlsx', cache_size=1024):
+        '''
+        In-memory datasets and population targets of the server.
+        -----------------------------------------------------------
+        :param population_path(str or Population): Optional.
+                                                   Defalt='population.xlsx'.
+        :param cache_size(int): Optional. Number of results kept. Defalt=1024
+        '''
+        if isinstance(population_path, Population):
+            self.population = population_path
+        else:
+            self.population = load_population(population_path)
+        self.datasets = {}
+        self.versions = {}
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        self.hits = self.misses = 0
+        self.lock = threading.RLock()
+
+    def load(self, name, data, encoding='utf_8_sig'):
+        '''
+        Load or replace a dataset; bumps its version, so its cached results
+        are no longer used.
+        :param data(str or pandas.DataFrame): A data file (see cli.read_columns)
+                                              or the data itself.
+        :return dict with dataset, version, rows and columns.
+        '''
+        frame = data if not isinstance(data, str) else read_columns(data, None, encoding=encoding)
+        with self.lock:
+            self.datasets[name] = frame
+            self.versions[name] = self.versions.get(name, 0) + 1
+            return self.info(name)
+
+    def info(self, name):
+        frame = self.dataset(name)
+        return {'dataset': name, 'version': self.versions[name], 'rows': len(frame),
+                'columns': [str(c) for c in frame.columns]}
+
+    def dataset(self, name):
+        if name not in self.datasets:
+            raise KeyError(f'Unknown dataset {name}.')
+        return self.datasets[name]
+
+    def cached(self, name, query, compute):
+        '''
+        Result of query on dataset name, from the LRU cache if it holds the
+        result of the current version.
+        :return (result, bool from the cache).
+        '''
+        with self.lock:
+            key = (name, self.versions.get(name), json.dumps(query, sort_keys=True))
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                self.hits += 1
+                return self.cache[key], True
+            self.misses += 1
+            frame = self.dataset(name)
+        result = compute(frame)
+        with self.lock:
+            self.cache[key] = result
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return result, False
+
+    def freq(self, dataset, var, w=None, label=None):
+        '''
+        Weighted frequency table, see Table.freq.
+        '''
+        query = {'op': 'freq', 'var': var, 'w': w, 'label': label}
+        return self.cached(dataset, query, lambda df: table_json(tabulation.freq(df, var, w=w, label=label)))
+
+    def cross(self, dataset, r_var, c_var, w=None, percent_by='row'):
+        '''
+        Weighted cross table, see Table.cross.
+        '''
+        query = {'op': 'cross', 'r_var': r_var, 'c_var': c_var, 'w': w, 'percent_by': percent_by}
+        return self.cached(dataset, query,
+                           lambda df: table_json(tabulation.cross(df, r_var, c_var, w=w,
+                                                                  percent_by=percent_by)))
+
+    def weight(self, dataset, method='ipf', w_col='weight', **kwargs):
+        '''
+        Weight a dataset and keep the weights as column w_col (a new version).
+        :param method(str), kwargs: See weighting.weights.
+        :return dict of info plus method, seconds and, for ipf/calibration,
+                iterations, converged and deff. Raises StaleDataset if the
+                dataset was replaced before the weights were kept.
+        '''
+        start = time.perf_counter()
+        with self.lock:
+            frame = self.dataset(dataset)
+            version = self.versions[dataset]
+        w = weighting(frame, population_path=self.population, weight_col_name=w_col, lean=True)
+        weights = w.weights(method, **kwargs)
+        with self.lock:
+            # Weighting runs outside the lock; do not overwrite a dataset
+            # loaded or weighted in the meantime.
+            if self.versions.get(dataset) != version:
+                raise StaleDataset(f'Dataset {dataset} changed while weighting; weight it again.')
+            self.datasets[dataset] = frame.assign(**{w_col: weights})
+            self.versions[dataset] += 1
+            result = self.info(dataset)
+        result.update({'method': method, 'seconds': time.perf_counter() - start,
+                       'iterations': getattr(w, 'iterations', None),
+                       'converged': getattr(w, 'converged', None), 'deff': getattr(w, 'deff', None)})
+        return result
+
+    def stats(self):
+        with self.lock:
+            return {'datasets': {k: self.versions[k] for k in self.datasets},
+                    'cached': len(self.cache), 'hits': self.hits, 'misses': self.misses}
+
+
+def table_json(frame):
+    '''
+    A table as {'index', 'columns', 'data'}, JSON-ready.
+    '''
+    return json.loads(frame.to_json(orient='split'))
+
+
+def handler(service):
+    '''
+    Request handler class of a service. Every route takes a JSON object
+    (POST body, or none for GET) and answers {'result', 'cached', 'seconds'}
+    or {'error'} with status 400 (bad request), 404 (unknown route or file),
+    409 (StaleDataset) or 500.
+    '''
+    def weight(body):
+        return service.weight(body.pop('dataset'), **body), False
+
+    routes = {'/freq': lambda b: service.freq(**b),
+              '/cross': lambda b: service.cross(**b),
+              '/weight': weight,
+              '/load': lambda b: (service.load(b['dataset'], b['path']), False),
+              '/stats': lambda b: (service.stats(), False)}
+
+    class Handler(BaseHTTPRequestHandler):
+        def answer(self, body):
+            start = time.perf_counter()
+            route = routes.get(self.path.rstrip('/'))
+            if route is None:
+                return self.send(404, {'error': f'Unknown route {self.path}.'})
+            try:
+                result, cached = route(body)
+            except FileNotFoundError as e:
+                return self.send(404, {'error': str(e)})
+            except StaleDataset as e:
+                return self.send(409, {'error': str(e)})
+            except (KeyError, ValueError, TypeError, OSError) as e:
+                return self.send(400, {'error': str(e)})
+            except Exception as e:
+                return self.send(500, {'error': f'{type(e).__name__}: {e}'})
+            self.send(200, {'result': result, 'cached': cached,
+                            'seconds': time.perf_counter() - start})
+
+        def send(self, status, payload):
+            data = json.dumps(payload, default=float, ensure_ascii=False).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            self.answer({})
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length', 0))
+            try:
+                body = json.loads(self.rfile.read(length) or b'{}')
+            except json.JSONDecodeError as e:
+                return self.send(400, {'error': f'Invalid JSON: {e}'})
+            self.answer(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def serve(service, host='127.0.0.1', port=8765):
+    '''
+    HTTP server of a service; call serve_forever() on it, or use a thread.
+    Port 0 picks a free port, see server.server_address.
+    '''
+    return ThreadingHTTPServer((host, port), handler(service))
+
+
+def query(url, route, payload=None):
+    '''
+    Client of the server, eg. query('http://127.0.0.1:8765', '/freq',
+    {'dataset': 'testdata', 'var': 'AGE'}).
+    :return dict of the answer.
+    '''
+    data = None if payload is None else json.dumps(payload).encode('utf-8')
+    with urlopen(Request(url + route, data=data,
+                         headers={'Content-Type': 'application/json'})) as response:
+        return json.loads(response.read())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Local service of weighted estimates.')
+    parser.add_argument('--data', nargs='*', default=[], help='Data files to load; named by file name.')
+    parser.add_argument('--population', default='population.xlsx')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--cache-size', type=int, default=1024)
+    args = parser.parse_args(argv)
+
+    service = WeightingService(args.population, cache_size=args.cache_size)
+    for path in args.data:
+        print(service.load(os.path.splitext(os.path.basename(path))[0], path))
+    server = serve(service, args.host, args.port)
+    print(f'Serving on http://{args.host}:{server.server_address[1]}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+#!/usr/bin/python
+# -*- encoding: utf-8 -*-
+# File    :   session.py
+# Description : Incremental re-weighting of a running wave. Keeps the cell
+#               counts and the last raking factors, so appending a batch of
+#               respondents costs O(batch) and re-raking runs on the table only,
+#               optionally starting from the previous solution.
+
+import time
+import numpy as np
+import pandas as pd
+from engine import cell_counts
+from population import Population, load_population
+from spec import WeightingSpec
+
+
+class WeightingSession:
+    def __init__(self, population_path='population.xlsx', method='ipf', spec=None,
+                 margins=None, cells=[], **kwargs):
+        '''
+        Build up an incremental weighting session.
+        --------------------------------------------
+        :param population_path(str or Population): Optional.
+                                                   Defalt='population.xlsx'.
+        :param method(str): Optional. 'ipf' (raking) or 'post'
+                            (post-stratification on cells[0], default 'SAA').
+                            Defalt='ipf'
+        :param spec(WeightingSpec): Optional. Defalt=None, eg. that of the
+                                    population data.
+        :param margins(list): Optional. Margin variables to rake on.
+                              Defalt=None, eg. every variable of spec.
+        :param cells(list): Optional. Cells targets to rake on. Defalt=[]
+        :param kwargs: Passed to WeightingSpec.rake, eg. tol, max_iter.
+        '''
+        if isinstance(population_path, Population):
+            population = population_path
+        else:
+            population = load_population(population_path)
+        self.spec = spec if spec is not None else WeightingSpec.from_population(population)
+        if method not in ['ipf', 'post']:
+            raise ValueError("method must be 'ipf' or 'post'.")
+        self.method = method
+        self.margins = margins
+        self.cells = list(cells)
+        self.kwargs = kwargs
+
+        self.counts = np.zeros(self.spec.shape)
+        self.codes = []
+        self.factor = None
+        self.stale = True # Respondents appended since the last update.
+        self.history = []
+
+    @property
+    def n(self):
+        return int(sum(len(c) for c in self.codes))
+
+    def append(self, data):
+        '''
+        Add a batch of respondents; costs O(len(data)).
+        :param data(pandas.DataFrame): Data holding every variable of self.spec.
+        '''
+        code, shape = self.spec.codes(data)
+        self.counts += cell_counts(code, shape)
+        self.codes.append(code)
+        self.stale = True
+
+    def update(self, warm=False):
+        '''
+        Re-weight the cumulative sample from its cell counts.
+        ------------------------------------------------------
+        The default cold start gives the weights of raking_ipf on the whole
+        sample, however it was batched. A warm start hits the same margins in
+        fewer sweeps, but when respondents have -1 values the margins do not
+        pin down how weight is split between them and the others, so their
+        weights then depend on the batches (by a few percent on testdata.csv).
+        :param warm(bool): Optional. Start raking from the factors of the
+                           previous update. Defalt=False
+        :return dict with n, iterations, converged, max_dev and seconds.
+        '''
+        start = time.perf_counter()
+        if self.method == 'post':
+            self.factor = self.spec.post(self.counts, self.cells[0] if self.cells else 'SAA')
+            records, converged = [], True
+        else:
+            if not warm:
+                self.factor = None
+            if self.factor is not None:
+                # Keep the scale of a cold start, sum of weights = n.
+                self.factor = self.factor * self.counts.sum() / (self.counts * self.factor).sum()
+            self.factor, records, converged = self.spec.rake(self.counts, margins=self.margins,
+                                                             cells=self.cells, factor=self.factor,
+                                                             **self.kwargs)
+        stats = {'n': self.n, 'iterations': len(records), 'converged': converged,
+                 'max_dev': records[-1]['max_dev'] if records else np.nan,
+                 'seconds': time.perf_counter() - start}
+        self.stale = False
+        self.history.append(stats)
+        return stats
+
+    def weights(self):
+        '''
+        Weight of every respondent appended so far, in order of arrival.
+        Re-weights first if respondents were appended since the last update.
+        :return numpy.ndarray of float.
+        '''
+        if self.stale:
+            self.update()
+        return self.factor.ravel()[np.concatenate(self.codes)]
+
+
+if __name__ == '__main__':
+    data = pd.read_csv('testdata.csv', encoding='utf_8_sig')
+    session = WeightingSession(tol=1e-6)
+    for batch in np.array_split(np.arange(len(data)), 8):
+        session.append(data.iloc[batch])
+        print(session.update())
+    print(session.weights()[:5])
@@ -0,0 +1,247 @@
+#!/usr/bin/python
+# -*- encoding: utf-8 -*-
+# File    :   spec.py
+# Description : Declarative weighting specification. Lists every weighting
+#               variable with its levels, population ratios and missing code,
+#               plus any cross-classified cell targets, and drives the array
+#               engine for post-stratification, raking and diagnostics.
+
+import numpy as np
+import pandas as pd
+from collapse import cached_plan
+from engine import (calibrate_cells, cell_codes, cell_counts, gof_totals, level_positions, post_cells,
+                    rake_cells, target_totals)
+
+
+class Dimension:
+    def __init__(self, name, levels, ratio=None, missing=-1, labels=None):
+        '''
+        One weighting variable.
+        -------------------------
+        :param name(str): The column of the variable in the data.
+        :param levels(list): The valid values.
+        :param ratio(list): Optional. Population ratio of every level,
+                            needed to rake on this variable.
+        :param missing(int): Optional. The code of missing values. Values that
+                             are neither a level nor this code are also treated
+                             as missing. Defalt=-1
+        :param labels(list): Optional. The label of every level.
+        '''
+        order = np.argsort(levels)
+        self.name = name
+        self.levels = np.asarray(levels)[order]
+        self.ratio = None if ratio is None else np.asarray(ratio, dtype=float)[order]
+        self.labels = None if labels is None else list(np.asarray(labels)[order])
+        self.missing = missing
+        if self.ratio is not None and len(self.ratio) != len(self.levels):
+            raise ValueError(f'{name}: {len(self.levels)} levels but {len(self.ratio)} ratios.')
+
+    def __repr__(self):
+        return f'Dimension({self.name!r}, levels={self.levels.tolist()})'
+
+    def positions(self, values):
+        '''
+        Level position of every value, -1 if missing.
+        '''
+        return level_positions(self.levels, np.asarray(values))
+
+
+class Cells:
+    def __init__(self, names, table, ratio_col='ratio'):
+        '''
+        A cross-classified target, eg. the SAA strata SEX x AGE x AREA.
+        ------------------------------------------------------------------
+        :param names(list): The crossed variables.
+        :param table(pandas.DataFrame): One row per cell with a column per
+                                        variable in names and ratio_col.
+        :param ratio_col(str): Optional. Defalt='ratio'
+        '''
+        self.names = list(names)
+        self.table = table
+        self.ratio_col = ratio_col
+
+    def __repr__(self):
+        return f'Cells({self.names!r}, {len(self.table)} cells)'
+
+
+class WeightingSpec:
+    def __init__(self, dimensions, cells=None):
+        '''
+        Weighting specification.
+        --------------------------
+        :param dimensions(list): Dimension of every weighting variable.
+        :param cells(dict): Optional. {name: Cells} cross-classified targets.
+        '''
+        self.dimensions = list(dimensions)
+        self.cells = dict(cells or {})
+        self.names = [d.name for d in self.dimensions]
+        for name, c in self.cells.items():
+            unknown = [v for v in c.names if v not in self.names]
+            if unknown:
+                raise ValueError(f'Cells {name} uses unknown variables {unknown}.')
+
+    def __getitem__(self, name):
+        return self.dimensions[self.names.index(name)]
+
+    def __repr__(self):
+        return f'WeightingSpec({self.names!r}, cells={list(self.cells)!r})'
+
+    @classmethod
+    def from_population(cls, population, var=None):
+        '''
+        Specification of the population targets: one Dimension per margin sheet
+        (SEX, AGE, EDU, AREA) and the SAA strata as Cells 'SAA'.
+        :param population(Population): The population targets.
+        :param var(list): Optional. Keep only these variables.
+        '''
+        dimensions = [Dimension(v, m.index.to_numpy(), m['ratio'].to_numpy(),
+                                labels=m['Label'].tolist() if 'Label' in m.columns else None)
+                      for v, m in population.margins.items()]
+        saa = population.saa.rename(columns={v.lower(): v for v in ['SEX', 'AGE', 'AREA']})
+        spec = cls(dimensions, {'SAA': Cells(['SEX', 'AGE', 'AREA'], saa)})
+        return spec if var is None else spec.subset(var)
+
+    def subset(self, var):
+        '''
+        Specification of the variables in var only, keeping the Cells they cover.
+        '''
+        cells = {k: c for k, c in self.cells.items() if all(v in var for v in c.names)}
+        return WeightingSpec([self[v] for v in var], cells)
+
+    def add(self, dimension):
+        '''
+        Specification with one more weighting variable.
+        '''
+        return WeightingSpec(self.dimensions + [dimension], self.cells)
+
+    @property
+    def shape(self):
+        return tuple(len(d.levels) + 1 for d in self.dimensions)
+
+    def codes(self, data):
+        '''
+        Cell code of every respondent.
+        :param data(pandas.DataFrame): Data holding every weighting variable.
+        :return (numpy.ndarray code, tuple shape of the contingency table).
+        '''
+        return cell_codes([data[d.name].to_numpy() for d in self.dimensions],
+                          [d.levels for d in self.dimensions])
+
+    def counts(self, data, weights=None, deterministic=False):
+        '''
+        Contingency table of the data.
+        :param deterministic(bool): Optional. Row-order independent weighted
+                                    sums, see engine.group_sums. Defalt=False
+        :return (numpy.ndarray counts, numpy.ndarray code of every respondent).
+        '''
+        code, shape = self.codes(data)
+        return cell_counts(code, shape, weights=weights, deterministic=deterministic), code
+
+    def cell_target(self, name):
+        '''
+        (axes, ratio) of Cells name, laid out over its non-missing levels.
+        Cells absent from the table get a NaN ratio.
+        '''
+        c = self.cells[name]
+        axes = tuple(sorted(self.names.index(v) for v in c.names))
+        ordered = [self.names[a] for a in axes]
+        ratio = np.full([len(self[v].levels) for v in ordered], np.nan)
+        pos = tuple(self[v].positions(c.table[v].to_numpy()) for v in ordered)
+        ratio[pos] = c.table[c.ratio_col].to_numpy()
+        return axes, ratio
+
+    def targets(self, margins=None, cells=[]):
+        '''
+        (axes, ratio) of the margins and cross-classified cells to weight on.
+        :param margins(list): Optional. Margin variables.
+                              Defalt=None, eg. every variable with a ratio.
+        :param cells(list): Optional. Names of Cells targets. Defalt=[]
+        '''
+        if margins is None:
+            margins = [d.name for d in self.dimensions if d.ratio is not None]
+        targets = [((self.names.index(v),), self[v].ratio) for v in margins]
+        return targets + [self.cell_target(c) for c in cells]
+
+    def rake(self, counts, margins=None, cells=[], **kwargs):
+        '''
+        Raking factor of every cell, see engine.rake_cells.
+        '''
+        return rake_cells(counts, self.targets(margins, cells), **kwargs)
+
+    def calibrate(self, counts, margins=None, cells=[], **kwargs):
+        '''
+        Calibration factor of every cell, see engine.calibrate_cells.
+        '''
+        return calibrate_cells(counts, self.targets(margins, cells), **kwargs)
+
+    def collapse(self, counts, cells='SAA', min_count=1, hierarchy=['AGE', 'AREA']):
+        '''
+        Collapse plan of the strata of Cells cells, see collapse.collapse_plan.
+        The plan is cached by sparsity pattern (collapse.cached_plan).
+        :param counts(numpy.ndarray): Contingency table of this specification.
+        :param min_count(float): Optional. Minimum respondents of a stratum. Defalt=1
+        :param hierarchy(list): Optional. Variables of cells to merge along, in
+                                order of preference; an item (name, levels)
+                                gives the adjacency order of the levels, eg.
+                                ('AREA', [1, 2, 4, 3, 5, 6]). Defalt=['AGE', 'AREA'],
+                                levels in their sorted order.
+        :return numpy.ndarray of the group of every stratum.
+        '''
+        axes, ratio = self.cell_target(cells)
+        plan = []
+        for item in hierarchy:
+            name, levels = (item, None) if isinstance(item, str) else item
+            axis = self.names.index(name)
+            if axis not in axes:
+                raise ValueError(f'{name} is not a variable of Cells {cells}.')
+            n = len(self[name].levels)
+            order = np.arange(n) if levels is None else self[name].positions(levels)
+            if sorted(order.tolist()) != list(range(n)):
+                raise ValueError(f'The levels of {name} must list every level once.')
+            plan.append((axes.index(axis), order.tolist()))
+        return cached_plan(target_totals(counts, axes), ratio, plan, min_count)
+
+    def post(self, counts, cells='SAA', group=None):
+        '''
+        Post-stratification factor of every cell, see engine.post_cells.
+        :param group(numpy.ndarray): Optional. Collapse plan from collapse.
+        '''
+        axes, ratio = self.cell_target(cells)
+        return post_cells(counts, axes, ratio, group=group)
+
+    def gof(self, table, margins=None, cells=[], decimals=None):
+        '''
+        Chi-square goodness of fit of a weighted contingency table.
+        :return pandas.DataFrame with chi2, p and dof per target,
+                and the Pearson residuals of every cell.
+        '''
+        names = (margins if margins is not None else
+                 [d.name for d in self.dimensions if d.ratio is not None]) + list(cells)
+        rows = []
+        for name, (axes, ratio) in zip(names, self.targets(margins, cells)):
+            obs = target_totals(table, axes)
+            keep = ~np.isnan(ratio)
+            chi, p, residuals = gof_totals(obs[keep], ratio[keep], decimals=decimals)
+            rows.append({'target': name, 'chi2': chi, 'p': p, 'dof': keep.sum() - 1,
+                         'residuals': residuals})
+        return pd.DataFrame(rows).set_index('target')
+
+    def achieved(self, table, margins=None, cells=[]):
+        '''
+        Weighted share of every level / cell of the targets against its ratio.
+        :param table(numpy.ndarray): Weighted contingency table.
+        :return pandas.DataFrame indexed by (target, level) with ratio,
+                achieved and gap; the level of a cell is a tuple of levels.
+        '''
+        names = (margins if margins is not None else
+                 [d.name for d in self.dimensions if d.ratio is not None]) + list(cells)
+        frames = []
+        for name, (axes, ratio) in zip(names, self.targets(margins, cells)):
+            totals = target_totals(table, axes)
+            levels = pd.MultiIndex.from_product([self.dimensions[a].levels for a in axes])
+            if len(axes) == 1:
+                levels = levels.get_level_values(0)
+            share = (totals / totals.sum()).ravel()
+            frames.append(pd.DataFrame({'target': name, 'level': list(levels), 'ratio': ratio.ravel(),
+                                        'achieved': share, 'gap': share - ratio.ravel()}))
+        return pd.concat(frames, ignore_index=True).set_index(['target', 'level'])
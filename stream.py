@@ -0,0 +1,96 @@
+#!/usr/bin/python
+# -*- encoding: utf-8 -*-
+# File    :   stream.py
+# Description : Two-pass weighting of survey files larger than memory.
+#               Pass 1 accumulates the SEX x AGE x EDU x AREA cell counts chunk
+#               by chunk, the weighting runs on that table, and pass 2 streams
+#               the rows again and writes each row with its weight.
+
+import numpy as np
+import pandas as pd
+from population import Population, load_population
+from spec import WeightingSpec
+from instrument import NULL
+
+
+def count_cells(path, spec, chunksize=100000, encoding='utf_8_sig'):
+    '''
+    Pass 1: contingency table of a CSV file, read chunk by chunk.
+    ----------------------------------------------------------------
+    Only the weighting columns are parsed.
+    :param spec(WeightingSpec): The weighting variables.
+    :return (numpy.ndarray counts, int number of rows).
+    '''
+    counts = np.zeros(spec.shape)
+    n = 0
+    for chunk in pd.read_csv(path, usecols=spec.names, chunksize=chunksize, encoding=encoding):
+        counts += spec.counts(chunk)[0]
+        n += len(chunk)
+    return counts, n
+
+
+def weight_csv(path, output, method='post', population_path='population.xlsx',
+               w_col='weight', chunksize=100000, encoding='utf_8_sig', spec=None, instrument=None,
+               **kwargs):
+    '''
+    Weight a CSV file without loading it into memory.
+    ---------------------------------------------------
+    Peak memory is bounded by chunksize, not by the number of respondents.
+    :param path(str): The CSV file to weight.
+    :param output(str): The CSV file to write, all columns plus w_col.
+    :param method(str): Optional. 'post' (post-stratification) or
+                        'ipf' (raking, see weighting.raking_ipf). Defalt='post'
+    :param population_path(str or Population): Optional.
+                                               Defalt='population.xlsx'.
+    :param w_col(str): Optional. The name of the column of weight.
+    :param chunksize(int): Optional. Rows read per chunk. Defalt=100000
+    :param encoding(str): Optional. Encoding of both files. Defalt='utf_8_sig'
+    :param spec(WeightingSpec): Optional. The weighting variables and targets.
+                                Defalt=None, eg. those of the population data.
+    :param instrument(instrument.Instrument): Optional. Receives the stages
+                                              and the raking outcome, see weighting.
+    :param kwargs: Passed to WeightingSpec.rake, eg. tol, max_iter, cells.
+    :return pandas.DataFrame of the per-sweep diagnostics (empty for 'post').
+    '''
+    instrument = instrument if instrument is not None else NULL
+    if method not in ['post', 'ipf']:
+        raise ValueError("method must be 'post' or 'ipf'.")
+    if isinstance(population_path, Population):
+        population = population_path
+    else:
+        with instrument.stage('load_population'):
+            population = load_population(population_path)
+    if spec is None:
+        spec = WeightingSpec.from_population(population)
+
+    with instrument.stage('count_cells'):
+        counts, n = count_cells(path, spec, chunksize=chunksize, encoding=encoding)
+    with instrument.stage(method, n=n):
+        if method == 'post':
+            table = spec.post(counts)
+            records = []
+        else:
+            table, records, converged = spec.rake(counts, **kwargs)
+    if records and instrument.enabled:
+        instrument.event('converged' if converged else 'not_converged', method='ipf',
+                         iterations=len(records), max_dev=records[-1]['max_dev'])
+    table = table.ravel()
+
+    with instrument.stage('write', n=n), open(output, 'w', encoding=encoding, newline='') as f:
+        header = True
+        # The weighting columns are parsed as in pass 1; every column is
+        # written back as the string read, so no chunk changes its format.
+        parsed = pd.read_csv(path, usecols=spec.names, chunksize=chunksize, encoding=encoding)
+        raw = pd.read_csv(path, chunksize=chunksize, encoding=encoding, dtype=str, keep_default_na=False)
+        for values, chunk in zip(parsed, raw):
+            code, _ = spec.codes(values)
+            chunk[w_col] = table[code]
+            chunk.to_csv(f, header=header, index=False)
+            header = False
+
+    return pd.DataFrame(records, columns=['iteration', 'max_dev', 'max_change', 'seconds',
+                                          'w_min', 'w_max', 'deff', 'ess']).set_index('iteration')
+
+
+if __name__ == '__main__':
+    print(weight_csv('testdata.csv', 'data_stream_weighted.csv', method='ipf', chunksize=500))
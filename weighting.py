@@ -6,297 +6,498 @@
 # Email:   yi75798@gmail.com
 # Description : Weighting program include Post-stratification and Raking
 
+import warnings
 import pandas as pd
 import numpy as np
 from AnalysisTool.analysis import *
 # from scipy.stats import chisquare # 這個已經沒用了...
-from scipy.stats import chi2
+from population import Population, load_population
+from engine import group_sums, chisq_gof, target_totals
+from spec import WeightingSpec
+from instrument import NULL
+
+STRATA_VARS = ['SEX', 'AGE', 'AREA'] # Variables crossed into the SAA strata.
+MARGIN_VARS = ['SEX', 'AGE', 'EDU', 'AREA'] # Variables raked on.
+
+def strata_table(population):
+    '''
+    Lay out the SAA sheet on the mixed-radix SEX x AGE x AREA codes.
+    :param population(Population): The population targets.
+    :return (group, ratio): numpy.ndarray indexed by strata code,
+                            group -1 and ratio NaN for cells absent in SAA.
+    '''
+    size = 1
+    code = np.zeros(len(population.saa), dtype=np.int64)
+    for var in STRATA_VARS:
+        levels = population.margins[var].index.to_numpy()
+        code = code * len(levels) + np.searchsorted(levels, population.saa[var.lower()].to_numpy())
+        size *= len(levels)
+    group = np.full(size, -1, dtype=np.int64)
+    ratio = np.full(size, np.nan)
+    group[code] = population.saa['group'].to_numpy()
+    ratio[code] = population.saa['ratio'].to_numpy()
+    return group, ratio
+
+def lean_column(values):
+    '''
+    Integer codes of a weighting variable in the smallest integer dtype that
+    holds every value, int8 for the usual survey codes.
+    :param values(pandas.Series): The column, NaN for missing.
+    :return numpy.ndarray of int, -1 for missing.
+    '''
+    values = values.fillna(-1).to_numpy()
+    if len(values) == 0:
+        return values.astype(np.int8)
+    dtype = np.result_type(np.int8, np.min_scalar_type(min(int(values.min()), -int(values.max()) - 1)))
+    return values.astype(dtype)
 
 class weighting:
-    def __init__(self, data, population_path='population.xlsx', weight_col_name='weight'):
+    def __init__(self, data, population_path='population.xlsx', weight_col_name='weight', lean=False,
+                 spec=None, instrument=None, compact=False):
         '''
         Build up a weighting machine.
         ---------------------------------
         :param data(pandas.DataFrame): The data wnat to be weight.
-        :param population_path(str): Optinal.
-                                     The path of the population data.
+        :param population_path(str or Population): Optinal.
+                                     The path of the population data, or targets
+                                     already loaded by population.load_population.
                                      Defalt='population.xlsx'.
         :param weight_col_name(str): Optional.
                                      The name of the column of weight.
                                      Defalt='weight'                             
+        :param lean(bool): Optional.
+                           Keep only the weighting variables as small integer
+                           columns (int8 unless a code needs more) instead of copying the whole data, so memory does not
+                           grow with the questionnaire width. Use weights() to
+                           get the weight vector. Defalt=False
+        :param spec(WeightingSpec): Optional.
+                                    The weighting variables and their targets.
+                                    Defalt=None, eg. SEX, AGE, EDU, AREA and the
+                                    SAA strata of the population data.
+        :param instrument(instrument.Instrument): Optional.
+                                    Receives the timing of every stage and the
+                                    raking progress, eg. instrument.Recorder(echo=True)
+                                    to print it. Defalt=None, eg. nothing
+                                    is recorded or printed.
+        :param compact(bool): Optional.
+                              Store the weights as float32 and add them up in a
+                              fixed order (see engine.group_sums), so the
+                              weights are bit-identical for any order of the
+                              rows and take half the memory. Defalt=False
         '''
-        self.df = data.copy()
-        self.df[weight_col_name] = 1
-        self.N_SAA = pd.read_excel(population_path, sheet_name='SAA', index_col='index')
-        self.N_SEX = pd.read_excel(population_path, sheet_name='SEX', index_col='Value')
-        self.N_AGE = pd.read_excel(population_path, sheet_name='AGE', index_col='Value')
-        self.N_EDU = pd.read_excel(population_path, sheet_name='EDU', index_col='Value')
-        self.N_AREA = pd.read_excel(population_path, sheet_name='AREA', index_col='Value')
-    
-    def stratified(self):
-        self.df['strata'] = None
-        for i in self.df.index:
-            if self.df['SEX'].loc[i] != -1:
-                sex = str(self.df['SEX'].loc[i])
-            else:
-                sex = ''
+        self.instrument = instrument if instrument is not None else NULL
+        if isinstance(population_path, Population):
+            self.population = population_path
+        else:
+            with self.instrument.stage('load_population'):
+                self.population = load_population(population_path)
+        self.spec = spec if spec is not None else WeightingSpec.from_population(self.population)
 
-            if self.df['AGE'].loc[i] != -1:
-                age = str(self.df['AGE'].loc[i])
-            else:
-                age = '' 
-            
-            if self.df['AREA'].loc[i] != -1:
-                area = str(self.df['AREA'].loc[i])
+        self.data = data
+        self.weight_col_name = weight_col_name
+        self.compact = compact
+        with self.instrument.stage('copy', lean=lean, n=len(data)):
+            if lean:
+                self.df = pd.DataFrame({v: lean_column(data[v])
+                                        for v in self.spec.names if v in data.columns}, index=data.index)
+                self.df[weight_col_name] = 1.0
             else:
-                area = ''
-            
-            strata_index = int(sex+age+area)
-            try:
-                self.df['strata'].loc[i] = self.N_SAA['group'].loc[strata_index]
-            except:
-                self.df['strata'].loc[i] = None
+                self.df = data.copy()
+                self.df[weight_col_name] = 1
+            if compact:
+                self.df[weight_col_name] = np.ones(len(data), dtype=np.float32)
+        self.N_SAA = self.population.saa
+        self.N_SEX = self.population.margins['SEX']
+        self.N_AGE = self.population.margins['AGE']
+        self.N_EDU = self.population.margins['EDU']
+        self.N_AREA = self.population.margins['AREA']
+        self.margins = self.population.margins
+    
+    def level_codes(self, var):
+        '''
+        Position of every respondent's category among the population levels.
+        ----------------------------------------------------------------------
+        :param var(str): The weighting variable, one of self.spec.names.
+        :return numpy.ndarray of int, -1 for missing or unknown values.
+        '''
+        return self.spec[var].positions(self.df[var].to_numpy())
+
+    def strata_codes(self):
+        '''
+        Mixed-radix SEX x AGE x AREA cell code of every respondent.
+        -------------------------------------------------------------
+        :return numpy.ndarray of int, -1 if any strata variable is missing.
+        '''
+        code = np.zeros(len(self.df), dtype=np.int64)
+        valid = np.ones(len(self.df), dtype=bool)
+        for var in STRATA_VARS:
+            pos = self.level_codes(var)
+            code = code * len(self.spec[var].levels) + pos
+            valid &= pos >= 0
+        return np.where(valid, code, -1)
+
+    def strata_table(self):
+        '''
+        Lay out the SAA sheet on the same mixed-radix codes.
+        -----------------------------------------------------
+        :return (group, ratio): numpy.ndarray indexed by strata code,
+                                group -1 and ratio NaN for cells absent in SAA.
+        '''
+        return strata_table(self.population)
+
+    def stratified(self):
+        '''
+        Attach the SAA group of every respondent as column 'strata'.
+        ------------------------------------------------------------
+        :return numpy.ndarray of the strata codes, -1 for respondents
+                without a valid SAA cell (their 'strata' is <NA>).
+        '''
+        code = self.strata_codes()
+        group, ratio = self.strata_table()
+        code = np.where((code >= 0) & (group[code] >= 0), code, -1)
+        strata = pd.array(group[code], dtype='Int64')
+        strata[code < 0] = pd.NA
+        self.df['strata'] = strata
+        return code
     
-    def post_stratification(self, weight_col='weight'):
+    def post_stratification(self, weight_col='weight', cells='SAA', min_count=None,
+                            hierarchy=['AGE', 'AREA']):
         '''
         Weight by post-stratification.
         -------------------------------
+        Respondents that cannot be stratified (a -1 in a stratum variable, or
+        a stratum without population share or respondents left after
+        collapsing) get a NaN weight, with a warning. Strata with a population
+        share but no respondents are warned about as well, as their share is
+        not given to anyone.
         :param weight_col(str): Optional.
                                 The name of the column of weight.
                                 Defalt='weight'
-        :return pandas.Dataframe with weight values column.                             
+        :param cells(str): Optional. The Cells target of self.spec to
+                           stratify on. Defalt='SAA'
+        :param min_count(int): Optional. Merge strata with fewer respondents
+                               (and empty strata) with adjacent ones.
+                               Defalt=None, eg. no collapsing.
+        :param hierarchy(list): Optional. Variables to merge along, in order of
+                                preference, see WeightingSpec.collapse.
+                                Defalt=['AGE', 'AREA']
+        :return pandas.Dataframe with weight values column.
+                With min_count, the group of every stratum is kept in
+                self.strata_groups.
         '''
-        self.stratified() 
-        self.N_SAA = self.N_SAA.set_index('group')
-        n = len(self.df)
-        for i in self.df.index:
-            strata = self.df['strata'].loc[i]
-            Ni_N = self.N_SAA['ratio'].loc[strata]
-            n_ni = (n/len(self.df[self.df['strata'] == strata]))
-
-            w = Ni_N * n_ni
-            self.df[weight_col].loc[i] = w
+        if cells == 'SAA':
+            with self.instrument.stage('stratified'):
+                self.stratified()
+        with self.instrument.stage('post_stratification', cells=cells):
+            spec = self.spec.subset(self.spec.cells[cells].names)
+            counts, code = spec.counts(self.df)
+            group = None
+            axes, ratio = spec.cell_target(cells)
+            if min_count is not None:
+                with self.instrument.stage('collapse', min_count=min_count):
+                    group = spec.collapse(counts, cells, min_count=min_count, hierarchy=hierarchy)
+                index = pd.MultiIndex.from_product([spec.dimensions[a].levels for a in axes],
+                                                   names=[spec.names[a] for a in axes])
+                self.strata_groups = pd.DataFrame({'group': group.ravel(), 'ratio': ratio.ravel(),
+                                                   'n': target_totals(counts, axes).ravel()},
+                                                  index=index)
+            w = spec.post(counts, cells, group=group).ravel()[code]
+            self.store(weight_col, w)
+        plan = np.arange(ratio.size) if group is None else group.ravel()
+        n_group = np.bincount(plan, weights=target_totals(counts, axes).ravel())
+        ratio_group = np.bincount(plan, weights=np.nan_to_num(ratio).ravel())
+        empty = (ratio_group > 0) & (n_group == 0)
+        if empty.any():
+            lost = float(ratio_group[empty].sum())
+            warnings.warn(f'{int(empty.sum())}個分層有母體比例但無受訪者，其母體比例{lost:.4f}未分配，'
+                          '權數總和小於樣本數(可用min_count合併分層)')
+            self.instrument.event('empty_strata', method='post', strata=int(empty.sum()), ratio=lost)
+        unweighted = int(np.isnan(w).sum())
+        if unweighted:
+            warnings.warn(f'{unweighted}位受訪者無法分層(遺漏值或樣本數為0的分層)，權數為NaN')
+            self.instrument.event('unweighted', method='post', n=unweighted)
+        if self.instrument.enabled:
+            self.instrument.event('margins', errors=self.margin_errors(weight_col))
         
         return self.df
+
     def chitest(self, var, w_col= 'weight', message=False):
         '''
         Chi-square test.
         ------------------
-        :param var(str): Variable to test.
+        Totals are rounded to integers as the raking() stopping rule always did;
+        use gof() for the unrounded statistic.
+        :param var(str): Variable to test, one of self.spec.names.
         :param w_col(str): Optional.
                            The column of the weight.
         :param message(bool): Whether to print the test result.
         :return Bool.
         '''
-        obs = Table(self.df[self.df[var] != -1]).freq(var, w=w_col)['Num'].values
-        n = rounding(self.df[self.df[var] != -1][w_col].sum())
-        if var == 'SEX':
-            exp = np.array(n * self.N_SEX['ratio'])
-            chi = np.square(obs - exp)/exp # 手算才是王道啦eo4!
-            chi = chi.sum()
-            p = chi2.sf(chi, 1)
-            # chi, p = chisquare(f_obs= obs, f_exp= exp, ddof= 0)
-
-            if message:    
-                print(f'chi2= {chi}, p = {p}')
-                if p >= 0.05:
-                    print('SEX consistent with population.')
-                    return True
-                else:
-                    print('SEX inconsistent with population.')
-                    return False
+        with self.instrument.stage('chitest', var=var):
+            chi, p, _ = self.gof(var, w_col=w_col, decimals=0)
+        if message:
+            print(f'chi2= {chi}, p = {p}')
+            if p >= 0.05:
+                print(f'{var} consistent with population.')
             else:
-                if p >= 0.05:
-                    return True
-                else:
-                    return False
-        if var == 'AGE':
-            exp = np.array(n * self.N_AGE['ratio'])
-            chi = np.square(obs - exp)/exp
-            chi = chi.sum()
-            p = chi2.sf(chi, 4)
-            #chi, p = chisquare(f_obs= obs, f_exp= exp, ddof= 0)
+                print(f'{var} inconsistent with population.')
+        return p >= 0.05
 
-            if message:    
-                print(f'chi2= {chi}, p = {p}')
-                if p >= 0.05:
-                    print('AGE consistent with population.')
-                    return True
-                else:
-                    print('AGE inconsistent with population.')
-                    return False
-            else:
-                if p >= 0.05:
-                    return True
-                else:
-                    return False
-        if var == 'EDU':
-            exp = np.array(n * self.N_EDU['ratio'])
-            chi = np.square(obs - exp)/exp
-            chi = chi.sum()
-            p = chi2.sf(chi, 4)
-            # chi, p = chisquare(f_obs= obs, f_exp= exp, ddof= 0)
+    def gof(self, var, w_col='weight', dof=None, decimals=None):
+        '''
+        Weighted chi-square goodness of fit of one margin variable.
+        -------------------------------------------------------------
+        :param var(str): Variable to test, one of self.spec.names.
+        :param w_col(str): Optional.
+                           The column of the weight.
+        :param dof(int): Optional. Degrees of freedom.
+                         Defalt=None, eg. number of levels - 1.
+        :param decimals(int): Optional. Round the totals first.
+                              Defalt=None, eg. unrounded.
+        :return (chi2, p, residuals), see chisq_gof.
+        '''
+        return chisq_gof(self.level_codes(var), self.df[w_col].to_numpy(dtype=float),
+                         self.spec[var].ratio, dof=dof, decimals=decimals,
+                         deterministic=self.compact)
 
-            if message:    
-                print(f'chi2= {chi}, p = {p}')
-                if p >= 0.05:
-                    print('EDU consistent with population.')
-                    return True
-                else:
-                    print('EDU inconsistent with population.')
-                    return False
-            else:
-                if p >= 0.05:
-                    return True
-                else:
-                    return False
-        if var == 'AREA':
-            exp = np.array(n * self.N_AREA['ratio'])
-            chi = np.square(obs - exp)/exp
-            chi = chi.sum()
-            p = chi2.sf(chi, 5)
-            # chi, p = chisquare(f_obs= obs, f_exp= exp, ddof= 0)
+    def store(self, w_col, w):
+        '''
+        Put a weight array in column w_col, as float32 in compact mode.
+        '''
+        self.df[w_col] = w.astype(np.float32) if self.compact else w
 
-            if message:    
-                print(f'chi2= {chi}, p = {p}')
-                if p >= 0.05:
-                    print('AREA consistent with population.')
-                    return True
-                else:
-                    print('AREA inconsistent with population.')
-                    return False
-            else:
-                if p >= 0.05:
-                    return True
-                else:
-                    return False
+    def margin_errors(self, w_col='weight', var=None):
+        '''
+        Largest absolute gap between a weighted share and its population ratio.
+        :param var(list): Optional. Defalt=None, eg. every variable of self.spec.
+        :return dict {variable: float}.
+        '''
+        w = self.df[w_col].to_numpy(dtype=float)
+        errors = {}
+        for v in var or self.spec.names:
+            pos = self.level_codes(v)
+            valid = pos >= 0
+            totals = group_sums(pos[valid], w[valid], len(self.spec[v].ratio), self.compact)
+            errors[v] = float(np.nanmax(np.abs(totals / totals.sum() - self.spec[v].ratio)))
+        return errors
+
+    def rake_var(self, var, weight_col='weight'):
+        '''
+        Rake the weights on one margin variable.
+        ------------------------------------------
+        The weighted total of every category is computed with one grouped
+        reduction and the adjustment factors are applied to the whole
+        weight array at once. Respondents coded -1 keep their weights.
+        :param var(str): The margin variable, one of self.spec.names.
+        :param weight_col(str): Optional.
+                                The name of the column of weight.
+                                Defalt='weight'
+        '''
+        with self.instrument.stage('rake_var', var=var):
+            self._rake_var(var, weight_col)
+
+    def _rake_var(self, var, weight_col):
+        target = self.spec[var].ratio
+        pos = self.level_codes(var)
+        w = self.df[weight_col].to_numpy(dtype=float, copy=True)
+
+        valid = pos >= 0
+        pos = pos[valid]
+        totals = group_sums(pos, w[valid], len(target), self.compact)
+
+        n = rounding(totals.sum())
+        factor = target * n / rounding(totals)
+        w[valid] *= factor[pos]
+        self.store(weight_col, w)
 
     def rake_sex(self, weight_col='weight'):
-        #W = self.df[weight_col].loc[i]
-        n = rounding(self.df[self.df['SEX'] != -1][weight_col].sum())
-        n0 = Table(self.df).freq('SEX', w=weight_col)['Num'].loc[0]
-        n1 = Table(self.df).freq('SEX', w=weight_col)['Num'].loc[1]
-        N0 = self.N_SEX['ratio'].loc[0]
-        N1 = self.N_SEX['ratio'].loc[1]
-        for i in self.df.index:
-            W = self.df[weight_col].loc[i]
-            if self.df['SEX'].loc[i] == 0:
-                self.df[weight_col].loc[i] = W * N0 * n/n0
-            elif self.df['SEX'].loc[i] == 1:
-                self.df[weight_col].loc[i] = W * N1 * n/n1
+        self.rake_var('SEX', weight_col=weight_col)
 
-    
     def rake_age(self, weight_col='weight'):
-        #W = self.df[weight_col].loc[i]
-        n = rounding(self.df[self.df['AGE'] != -1][weight_col].sum())
-        n1 = Table(self.df).freq('AGE', w=weight_col)['Num'].loc[1]
-        n2 = Table(self.df).freq('AGE', w=weight_col)['Num'].loc[2]
-        n3 = Table(self.df).freq('AGE', w=weight_col)['Num'].loc[3]
-        n4 = Table(self.df).freq('AGE', w=weight_col)['Num'].loc[4]
-        n5 = Table(self.df).freq('AGE', w=weight_col)['Num'].loc[5]
-        N1 = self.N_AGE['ratio'].loc[1]
-        N2 = self.N_AGE['ratio'].loc[2]
-        N3 = self.N_AGE['ratio'].loc[3]
-        N4 = self.N_AGE['ratio'].loc[4]
-        N5 = self.N_AGE['ratio'].loc[5]
-        
-        for i in self.df.index:
-            W = self.df[weight_col].loc[i]
-            if self.df['AGE'].loc[i] == 1:
-                self.df[weight_col].loc[i] = W * N1 * n/n1
-            elif self.df['AGE'].loc[i] == 2:
-                self.df[weight_col].loc[i] = W * N2 * n/n2
-            elif self.df['AGE'].loc[i] == 3:
-                self.df[weight_col].loc[i] = W * N3 * n/n3
-            elif self.df['AGE'].loc[i] == 4:
-                self.df[weight_col].loc[i] = W * N4 * n/n4
-            elif self.df['AGE'].loc[i] == 5:
-                self.df[weight_col].loc[i] = W * N5 * n/n5
-    
+        self.rake_var('AGE', weight_col=weight_col)
+
     def rake_edu(self, weight_col='weight'):
-        #W = self.df[weight_col].loc[i]
-        n = rounding(self.df[self.df['EDU'] != -1][weight_col].sum())
-        n1 = Table(self.df).freq('EDU', w=weight_col)['Num'].loc[1]
-        n2 = Table(self.df).freq('EDU', w=weight_col)['Num'].loc[2]
-        n3 = Table(self.df).freq('EDU', w=weight_col)['Num'].loc[3]
-        n4 = Table(self.df).freq('EDU', w=weight_col)['Num'].loc[4]
-        n5 = Table(self.df).freq('EDU', w=weight_col)['Num'].loc[5]
-        N1 = self.N_EDU['ratio'].loc[1]
-        N2 = self.N_EDU['ratio'].loc[2]
-        N3 = self.N_EDU['ratio'].loc[3]
-        N4 = self.N_EDU['ratio'].loc[4]
-        N5 = self.N_EDU['ratio'].loc[5]
-        
-        for i in self.df.index:
-            W = self.df[weight_col].loc[i]
-            if self.df['EDU'].loc[i] == 1:
-                self.df[weight_col].loc[i] = W * N1 * n/n1
-            elif self.df['EDU'].loc[i] == 2:
-                self.df[weight_col].loc[i] = W * N2 * n/n2
-            elif self.df['EDU'].loc[i] == 3:
-                self.df[weight_col].loc[i] = W * N3 * n/n3
-            elif self.df['EDU'].loc[i] == 4:
-                self.df[weight_col].loc[i] = W * N4 * n/n4
-            elif self.df['EDU'].loc[i] == 5:
-                self.df[weight_col].loc[i] = W * N5 * n/n5
-    
+        self.rake_var('EDU', weight_col=weight_col)
+
     def rake_area(self, weight_col='weight'):
-        #W = self.df[weight_col].loc[i]
-        n = rounding(self.df[self.df['AREA'] != -1][weight_col].sum())
-        n1 = Table(self.df).freq('AREA', w=weight_col)['Num'].loc[1]
-        n2 = Table(self.df).freq('AREA', w=weight_col)['Num'].loc[2]
-        n3 = Table(self.df).freq('AREA', w=weight_col)['Num'].loc[3]
-        n4 = Table(self.df).freq('AREA', w=weight_col)['Num'].loc[4]
-        n5 = Table(self.df).freq('AREA', w=weight_col)['Num'].loc[5]
-        n6 = Table(self.df).freq('AREA', w=weight_col)['Num'].loc[6]
-        N1 = self.N_AREA['ratio'].loc[1]
-        N2 = self.N_AREA['ratio'].loc[2]
-        N3 = self.N_AREA['ratio'].loc[3]
-        N4 = self.N_AREA['ratio'].loc[4]
-        N5 = self.N_AREA['ratio'].loc[5]
-        N6 = self.N_AREA['ratio'].loc[6]
-        
-        for i in self.df.index:
-            W = self.df[weight_col].loc[i]
-            if self.df['AREA'].loc[i] == 1:
-                self.df[weight_col].loc[i] = W * N1 * n/n1
-            elif self.df['AREA'].loc[i] == 2:
-                self.df[weight_col].loc[i] = W * N2 * n/n2
-            elif self.df['AREA'].loc[i] == 3:
-                self.df[weight_col].loc[i] = W * N3 * n/n3
-            elif self.df['AREA'].loc[i] == 4:
-                self.df[weight_col].loc[i] = W * N4 * n/n4
-            elif self.df['AREA'].loc[i] == 5:
-                self.df[weight_col].loc[i] = W * N5 * n/n5
-            elif self.df['AREA'].loc[i] == 6:
-                self.df[weight_col].loc[i] = W * N6 * n/n6
-    
+        self.rake_var('AREA', weight_col=weight_col)
+
     def raking(self, w_col='weight', var = ['SEX', 'AGE', 'EDU', 'AREA']):
         # chilist = [self.chitest(v, w_col=w_col) for v in var]
 
         r = 1
         while not all([self.chitest(v, w_col=w_col) for v in var]):
-            print(f'第{r}輪加權')
-            if ('SEX' in var) & (self.chitest('SEX') == False):
-                self.rake_sex()
-                r += 1
-                continue
-            if ('AGE' in var) & (self.chitest('AGE') == False):
-                self.rake_age()
-                r += 1
-                continue
-            if ('EDU' in var) & (self.chitest('EDU') == False):
-                self.rake_edu()
-                r += 1
-                continue
-            if ('AREA' in var) & (self.chitest('AREA') == False):
-                self.rake_area()
-                r += 1
-                continue
+            self.instrument.event('round', method='raking', round=r)
+            for v in var:
+                if self.chitest(v, w_col=w_col) == False:
+                    self.rake_var(v, weight_col=w_col)
+                    r += 1
+                    break
             
-        print(f'Raking至第{r-1}輪收斂')
+        self.iterations = r - 1
+        if self.instrument.enabled:
+            self.instrument.event('converged', method='raking', iterations=r - 1,
+                                  errors=self.margin_errors(w_col, var))
+        return self.df
+
+    def raking_ipf(self, w_col='weight', var=['SEX', 'AGE', 'EDU', 'AREA'], cells=[],
+                   tol=1e-4, rel_tol=None, max_iter=100, trim=None, trim_relative=False):
+        '''
+        Raking by iterative proportional fitting.
+        -------------------------------------------
+        The sample is first collapsed into its cross-classified cell totals
+        (see rake_cells), so a sweep costs the same for any sample size; the
+        cell factors are then gathered back onto the respondents.
+        Every margin in var is adjusted in each sweep. The iteration stops when
+        the largest absolute gap between a weighted share and its population
+        ratio is at most tol, or when no weight moved by more than rel_tol
+        (relative) in the last sweep, or after max_iter sweeps.
+        :param w_col(str): Optional.
+                           The column of the weight.
+        :param var(list): Optional. The margin variables, any of self.spec.names.
+        :param cells(list): Optional. Cells targets of self.spec to rake on
+                            as well, eg. ['SAA']. Defalt=[]
+        :param tol(float): Optional. Maximum absolute margin deviation.
+                           Defalt=1e-4
+        :param rel_tol(float): Optional. Maximum relative change of the weights.
+                               Defalt=None, eg. not used.
+        :param max_iter(int): Optional. Hard cap of the number of sweeps.
+                              Defalt=100
+        :param trim(tuple): Optional. (lower, upper) caps of the weights, either
+                            may be None. Weights are capped with redistribution
+                            inside every sweep. The weights in w_col must be
+                            equal within every cell of var (and cells), eg.
+                            all 1, as the caps are applied to the cells.
+                            Defalt=None
+        :param trim_relative(bool): Optional. The caps are multiples of the
+                                    median weight. Defalt=False
+        :return pandas.Dataframe with weight values column.
+                The per-sweep record (max_dev, max_change, seconds, w_min, w_max,
+                deff, ess) is kept in self.diagnostics, the outcome in
+                self.converged, the cell factors in self.cell_factor and the
+                Kish design effect and effective sample size in self.deff, self.ess.
+        '''
+        w = self.df[w_col].to_numpy(dtype=float, copy=True)
+        dims = list(var) + [v for c in cells for v in self.spec.cells[c].names if v not in var]
+        spec = self.spec.subset(list(dict.fromkeys(dims)))
+        with self.instrument.stage('cell_counts'):
+            counts, code = spec.counts(self.df, weights=w, deterministic=self.compact)
+            respondents = np.bincount(code, minlength=counts.size).reshape(counts.shape)
+        if trim is not None:
+            mean = np.divide(counts, respondents, out=np.ones(counts.shape), where=respondents > 0)
+            if not np.allclose(w, mean.ravel()[code], rtol=1e-9, atol=0):
+                raise ValueError(f'trim needs the weights in {w_col} to be equal within every cell; '
+                                 'the caps cannot hold for unequal starting weights.')
+
+        with self.instrument.stage('rake_cells', cells=int(counts.size)):
+            factor, records, self.converged = spec.rake(counts, margins=var, cells=cells, tol=tol,
+                                                        rel_tol=rel_tol, max_iter=max_iter,
+                                                        trim=trim, trim_relative=trim_relative,
+                                                        respondents=respondents)
+        self.cell_factor = factor
+        self.diagnostics = pd.DataFrame(records).set_index('iteration')
+        self.iterations = r = len(records)
+        w = w * factor.ravel()[code]
+        self.deff = len(w) * np.square(w).sum() / w.sum() ** 2
+        self.ess = len(w) / self.deff
+        self.store(w_col, w)
+        if self.instrument.enabled:
+            for record in records:
+                self.instrument.event('sweep', method='ipf', **record)
+            self.instrument.event('converged' if self.converged else 'not_converged', method='ipf',
+                                  iterations=r, max_dev=records[-1]['max_dev'],
+                                  deff=self.deff, errors=self.margin_errors(w_col, var))
         return self.df
       
+    def calibration(self, w_col='weight', var=['SEX', 'AGE', 'EDU', 'AREA'], cells=[],
+                    distance='linear', bounds=None, tol=1e-8, max_iter=50):
+        '''
+        Weight by calibration (GREG and its bounded variants).
+        ---------------------------------------------------------
+        Every margin in var, and the Cells in cells, are hit at once by Newton
+        steps on the cell table (see engine.calibrate_cells), so the number of
+        iterations hardly grows with more margins or respondents. The current
+        weights in w_col are the design weights.
+        :param w_col(str): Optional.
+                           The column of the weight.
+        :param var(list): Optional. The margin variables, any of self.spec.names.
+        :param cells(list): Optional. Cells targets of self.spec, eg. ['SAA'].
+                            Defalt=[]
+        :param distance(str): Optional. 'linear' (GREG, may give weights < 0),
+                              'raking' (exponential; the solution of
+                              raking_ipf only when no respondent misses a
+                              weighting variable), 'logit' or 'truncated'
+                              (both keep the factors within bounds).
+                              Defalt='linear'
+        :param bounds(tuple): Optional. (L, U) factor bounds of 'logit' and
+                              'truncated', L < 1 < U. Defalt=None
+        :param tol(float): Optional. Maximum absolute margin deviation.
+                           Defalt=1e-8
+        :param max_iter(int): Optional. Maximum number of Newton steps.
+                              Defalt=50
+        :return pandas.Dataframe with weight values column.
+                As raking_ipf, the per-step record is kept in self.diagnostics
+                and the outcome in self.converged, self.cell_factor,
+                self.iterations, self.deff and self.ess; the achieved share of
+                every target level is kept in self.achieved.
+        '''
+        w = self.df[w_col].to_numpy(dtype=float, copy=True)
+        dims = list(var) + [v for c in cells for v in self.spec.cells[c].names if v not in var]
+        spec = self.spec.subset(list(dict.fromkeys(dims)))
+        with self.instrument.stage('cell_counts'):
+            counts, code = spec.counts(self.df, weights=w, deterministic=self.compact)
+            respondents = np.bincount(code, minlength=counts.size).reshape(counts.shape)
+
+        with self.instrument.stage('calibrate_cells', cells=int(counts.size), distance=distance):
+            factor, records, self.converged = spec.calibrate(counts, margins=var, cells=cells,
+                                                             distance=distance, bounds=bounds,
+                                                             tol=tol, max_iter=max_iter,
+                                                             respondents=respondents)
+        self.cell_factor = factor
+        self.diagnostics = pd.DataFrame(records).set_index('iteration')
+        self.iterations = r = len(records)
+        self.achieved = spec.achieved(counts * factor, margins=var, cells=cells)
+        w = w * factor.ravel()[code]
+        self.deff = len(w) * np.square(w).sum() / w.sum() ** 2
+        self.ess = len(w) / self.deff
+        self.store(w_col, w)
+        if self.instrument.enabled:
+            for record in records:
+                self.instrument.event('sweep', method='calibration', **record)
+            self.instrument.event('converged' if self.converged else 'not_converged',
+                                  method='calibration', iterations=r, max_dev=records[-1]['max_dev'],
+                                  deff=self.deff, errors=self.margin_errors(w_col, var))
+        return self.df
+
+    def weights(self, method='post', inplace=False, **kwargs):
+        '''
+        Weight and return only the weight vector.
+        -------------------------------------------
+        :param method(str): Optional. 'post' (post_stratification), 'raking',
+                            'ipf' (raking_ipf) or 'calibration'. Defalt='post'
+        :param inplace(bool): Optional. Also attach the weights to the data
+                              passed in, as column weight_col_name.
+                              Defalt=False
+        :param kwargs: Passed to post_stratification/raking/raking_ipf/calibration,
+                       eg. min_count for 'post'.
+        :return numpy.ndarray of float (float32 in compact mode).
+        '''
+        w_col = self.weight_col_name
+        if method == 'post':
+            self.post_stratification(weight_col=w_col, **kwargs)
+        elif method == 'raking':
+            self.raking(w_col=w_col, **kwargs)
+        elif method == 'ipf':
+            self.raking_ipf(w_col=w_col, **kwargs)
+        elif method == 'calibration':
+            self.calibration(w_col=w_col, **kwargs)
+        else:
+            raise ValueError("method must be 'post', 'raking', 'ipf' or 'calibration'.")
+        w = self.df[w_col].to_numpy(dtype=np.float32 if self.compact else float)
+        if inplace:
+            self.data[w_col] = w
+        return w
+
 
 if __name__ == '__main__':
     data = pd.read_csv('testdata.csv', encoding='utf_8_sig')